@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+"""
+Compare the cost of collecting the variables of rule functions (`input_`,
+`output`, `cmd`...) with the former `sys.setprofile` tracer of the `rule`
+decorator, and with `sf.rule_capture.capture_rule_vars` (rule variables
+defined as locals, or returned explicitly).
+
+The rule functions used mimic real ones: they build `IO_type`-like objects
+and call a few helper functions, which is what the former tracer was paying
+for.
+"""
+
+import sys
+import argparse
+from time import time
+
+from sf.rule_capture import capture_rule_vars
+
+
+class Fake_IO:
+    def __init__(self, type_, value):
+        self.type  = type_
+        self.value = value
+        self.validate()
+
+    def validate(self):
+        return self.type in ('path', 'str')
+
+
+def helper(value, depth):
+    return value if depth == 0 else helper(value, depth - 1)
+
+
+def make_rules(nested: int):
+    def implicit_rule(sample, **kwargs):
+        input_ = {
+            'reads': Fake_IO('path', helper(f'{sample}.fastq', nested)),
+            'ref'  : Fake_IO('path', helper('genome.fa', nested)),
+            }
+        output = {'bam': 'aligned.bam'}
+        cmd = f"align {input_['ref'].value} {input_['reads'].value} > {output['bam']}"
+
+    def explicit_rule(sample, **kwargs):
+        input_ = {
+            'reads': Fake_IO('path', helper(f'{sample}.fastq', nested)),
+            'ref'  : Fake_IO('path', helper('genome.fa', nested)),
+            }
+        output = {'bam': 'aligned.bam'}
+        cmd = f"align {input_['ref'].value} {input_['reads'].value} > {output['bam']}"
+        return locals()
+
+    return implicit_rule, explicit_rule
+
+
+def legacy_capture(func, args, kwargs):
+    # former implementation of the `rule` decorator
+    rule_vars = {}
+    def tracer(frame, event, arg):
+        if event == 'return':
+            rule_vars.update(frame.f_locals)
+        return tracer
+    sys.setprofile(tracer)
+    func(*args, **kwargs)
+    sys.setprofile(None)
+    return rule_vars
+
+
+def bench(capture, func, ncalls: int):
+    start = time()
+    for num in range(ncalls):
+        rule_vars = capture(func, (f'sample{num}', ), {'replicate_name': f'rep{num}'})
+    elapsed = time() - start
+    assert rule_vars['cmd'].startswith('align'), 'rule variables not captured'
+    return elapsed
+
+
+def main():
+    opts = get_options()
+    implicit_rule, explicit_rule = make_rules(opts.nested)
+
+    print(f"Python {sys.version.split()[0]}, {opts.calls} rule invocations, "
+          f"{opts.nested} nested helper calls per input")
+    baseline = bench(lambda f, a, k: f(*a, **k) or {'cmd': 'align'},
+                     implicit_rule, opts.calls)
+    print(f"  - no capture (plain calls)     : {baseline:7.3f} s")
+    timings = [
+        ('former sys.setprofile tracer', legacy_capture   , implicit_rule),
+        ('capture, local variables'   , capture_rule_vars, implicit_rule),
+        ('capture, explicit return'   , capture_rule_vars, explicit_rule),
+        ]
+    for label, capture, func in timings:
+        elapsed = bench(capture, func, opts.calls)
+        print(f"  - {label:<29}: {elapsed:7.3f} s "
+              f"({opts.calls / elapsed:9.0f} rules/s, "
+              f"overhead: {elapsed - baseline:6.3f} s)")
+
+
+def get_options():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=100_000,
+                        help='number of rule invocations')
+    parser.add_argument('--nested', type=int, default=3,
+                        help='depth of helper calls made for each input')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
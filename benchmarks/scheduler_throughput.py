@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+"""
+Compare the number of jobs per second dispatched by the event-driven
+scheduler (`sf.scheduler.Scheduler`) with the former 0.1 s polling loop of
+`snap_scheduler`.
+
+Jobs are trivial commands (`true`) organized in independent chains, so that
+the measured time is almost exclusively scheduler overhead.
+"""
+
+import argparse
+from subprocess import Popen, PIPE
+from time       import sleep, time
+
+from sf.scheduler import Scheduler, parse_jobs
+
+
+def make_job_list(njobs: int, chain: int):
+    """
+    :param njobs: number of jobs
+    :param chain: length of dependency chains (each job depends on the previous
+       one in its chain)
+    """
+    lines = []
+    for jid in range(1, njobs + 1):
+        depe = f';depe {jid - 1}' if (jid - 1) % chain else ''
+        lines.append(f'[name job_{jid};cpus-per-task 1;mem 0{depe}] true\n')
+    return lines
+
+
+def _all_satisfied(jid: int, jobs: dict, pending_jobs: dict):
+    dependencies = jobs[jid]['depe']
+    if len(dependencies) == 0:
+        return True
+    if all(jobs[dep]['status'] == 'done' for dep in dependencies):
+        return True
+    if any(jobs[dep]['status'] in ['error', 'unsatisfiable'] for dep in dependencies):
+        del pending_jobs[jid]
+        jobs[jid]['status'] = 'unsatisfiable'
+    return False
+
+
+def polling_loop(jobs: dict, total_cpu: int, total_mem: float):
+    """
+    Main loop of snap_scheduler before the event-driven core (without display).
+    """
+    available_cpu = total_cpu
+    available_mem = total_mem
+    procs = {}
+    pending_jobs = dict((jid, None) for jid in jobs)
+    while pending_jobs:
+        for jid in list(pending_jobs.keys()):
+            if (jobs[jid]['cpus-per-task'] <= available_cpu and
+                jobs[jid]['mem'] <= available_mem and
+                jobs[jid]['status'] in ['pending', 'dependent'] and
+                _all_satisfied(jid, jobs, pending_jobs)):
+                available_cpu -= jobs[jid]['cpus-per-task']
+                available_mem -= jobs[jid]['mem']
+                procs[jid] = Popen(jobs[jid]['cmd'], shell=True,
+                                   stdout=PIPE, stderr=PIPE)
+                jobs[jid]['status'] = 'running'
+        for jid, proc in procs.items():
+            return_code = proc.poll()
+            if return_code is not None:
+                if return_code != 0:
+                    jobs[jid]['status'] = 'error'
+                else:
+                    jobs[jid]['status'] = 'done'
+                    for tmp_jid in jobs:
+                        if jid in jobs[tmp_jid]['depe']:
+                            jobs[tmp_jid]['depe'].remove(jid)
+                        if len(jobs[tmp_jid]['depe']) == 0 and jobs[tmp_jid]['status'] == 'dependent':
+                            jobs[tmp_jid]['status'] = 'pending'
+                available_cpu += jobs[jid]['cpus-per-task']
+                available_mem += jobs[jid]['mem']
+                del procs[jid]
+                del pending_jobs[jid]
+                break
+        sleep(0.1)
+
+
+def event_driven(jobs: dict, total_cpu: int, total_mem: float):
+    Scheduler(jobs, total_cpu, total_mem).run()
+
+
+def main():
+    opts = get_options()
+    lines = make_job_list(opts.jobs, opts.chain)
+    print(f'{opts.jobs} jobs, chains of {opts.chain}, {opts.cpus} CPUs')
+    timings = {}
+    for name, loop in [('event-driven', event_driven), ('polling', polling_loop)]:
+        if name == 'polling' and opts.skip_polling:
+            continue
+        jobs = parse_jobs(lines)
+        start = time()
+        loop(jobs, opts.cpus, 1)
+        timings[name] = time() - start
+        assert all(j['status'] == 'done' for j in jobs.values())
+        print(f'{name:<15}{timings[name]:>9.2f} s {opts.jobs / timings[name]:>10.1f} jobs/s')
+    if len(timings) == 2:
+        print(f"speedup: {timings['polling'] / timings['event-driven']:.1f}x")
+
+
+def get_options():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=500,
+                        help='number of jobs to schedule')
+    parser.add_argument('--chain', type=int, default=10,
+                        help='length of the dependency chains')
+    parser.add_argument('--cpus', type=int, default=8,
+                        help='number of CPUs available to the scheduler')
+    parser.add_argument('--skip_polling', action='store_true',
+                        help='only measure the event-driven scheduler')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
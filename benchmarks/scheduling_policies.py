@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+"""
+Compare the makespan of the scheduling policies of `sf.scheduler.Scheduler`
+('greedy' and 'critical-path') on synthetic workflows, using the simulator
+(`sf.scheduler.Simulator`: jobs last exactly their declared time).
+
+Each synthetic workflow is a layered DAG mixing many short single-CPU jobs
+with a few long wide jobs (e.g. a `map_hic_full` step requesting most of the
+CPUs). The lower bound reported is the maximum of the critical path and of the
+total CPU time divided by the number of CPUs.
+"""
+
+import random
+import argparse
+
+from sf.scheduler           import Simulator, critical_path, job_duration, parse_jobs
+from sf.IO_utils.time_utils import seconds_to_time
+
+
+def make_job_list(rng: random.Random, layers: int, width: int, cpus: int,
+                  wide_fraction: float) -> list:
+    """
+    :param rng: random number generator
+    :param layers: number of layers in the DAG
+    :param width: average number of jobs per layer
+    :param cpus: number of CPUs of the machine (wide jobs request most of them)
+    :param wide_fraction: fraction of wide jobs
+    """
+    lines = []
+    previous = []
+    for _ in range(layers):
+        current = []
+        for _ in range(max(1, int(rng.gauss(width, width / 3)))):
+            jid = len(lines) + 1
+            if rng.random() < wide_fraction:
+                ncpus    = max(2, int(cpus * rng.uniform(0.5, 0.9)))
+                duration = rng.randint(1800, 7200)
+            else:
+                ncpus    = 1
+                duration = rng.randint(60, 900)
+            depe = ''
+            if previous:
+                parents = rng.sample(previous, min(len(previous), rng.randint(1, 3)))
+                depe = f";depe {','.join(str(p) for p in sorted(parents))}"
+            lines.append(f"[name job_{jid};cpus-per-task {ncpus};mem 0;"
+                         f"time {seconds_to_time(duration)}{depe}] true\n")
+            current.append(jid)
+        previous = current
+    return lines
+
+
+def lower_bound(jobs: dict, cpus: int) -> float:
+    cpu_time = sum(job['cpus-per-task'] * job_duration(job) for job in jobs.values())
+    return max(max(critical_path(jobs).values()), cpu_time / cpus)
+
+
+def main():
+    opts = get_options()
+    rng = random.Random(opts.seed)
+    print(f"{opts.workflows} workflows of {opts.layers} layers (~{opts.width} jobs each), "
+          f"{opts.cpus} CPUs, {opts.wide:.0%} wide jobs\n")
+    print(f"{'workflow':>8} {'jobs':>6} {'lower bound':>12} {'greedy':>12} "
+          f"{'critical-path':>14} {'gain':>7}")
+    total = {'greedy': 0, 'critical-path': 0}
+    for num in range(1, opts.workflows + 1):
+        lines = make_job_list(rng, opts.layers, opts.width, opts.cpus, opts.wide)
+        makespans = {}
+        for policy in ('greedy', 'critical-path'):
+            jobs = parse_jobs(lines)
+            simulator = Simulator(jobs, opts.cpus, 1, policy=policy)
+            simulator.run()
+            assert all(j['status'] == 'done' for j in jobs.values())
+            makespans[policy] = simulator.clock
+            total[policy] += simulator.clock
+        bound = lower_bound(parse_jobs(lines), opts.cpus)
+        gain = 1 - makespans['critical-path'] / makespans['greedy']
+        print(f"{num:>8} {len(lines):>6} {seconds_to_time(bound):>12} "
+              f"{seconds_to_time(makespans['greedy']):>12} "
+              f"{seconds_to_time(makespans['critical-path']):>14} {gain:>7.1%}")
+    print(f"\nTotal makespan: greedy {seconds_to_time(total['greedy'])}, "
+          f"critical-path {seconds_to_time(total['critical-path'])} "
+          f"({1 - total['critical-path'] / total['greedy']:.1%} shorter)")
+
+
+def get_options():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workflows', type=int, default=10,
+                        help='number of synthetic workflows')
+    parser.add_argument('--layers', type=int, default=8,
+                        help='number of layers of each workflow')
+    parser.add_argument('--width', type=int, default=40,
+                        help='average number of jobs per layer')
+    parser.add_argument('--cpus', type=int, default=16,
+                        help='number of CPUs available to the scheduler')
+    parser.add_argument('--wide', type=float, default=0.05,
+                        help='fraction of wide (multi-CPU, long) jobs')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed of the random number generator')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
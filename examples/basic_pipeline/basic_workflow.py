@@ -31,13 +31,15 @@ def main():
         raise KeyError(f'ERROR: sample name should be one of: [{", ".join(list(params.keys()))}]')
 
     # prepare working directory
-    create_workdir(result_dir, sample, singularity_img, sif_bind, params)
+    create_workdir(result_dir, sample, singularity_img, sif_bind, params,
+                   dry_run=opts.dry_run)
 
     ###########################################################################
     # START WORKFLOW
 
     # place to store workflow jobs:
-    processes = Process_dict(params, name='Basic pipeline')
+    processes = Process_dict(params, name='Basic pipeline', lazy_fs=True,
+                             dry_run=opts.dry_run)
 
     ## Split sequences in the fasta into different files
     for rep, replicate in enumerate(params['input'], 1):
@@ -70,6 +72,8 @@ def get_options():
                         help='PATH to folder to bind to singularity')
     parser.add_argument('--sequential', action='store_true',
                         help='''outputs commands without depencies or cpu/time indications.''')
+    parser.add_argument('--dry_run', action='store_true',
+                        help='''outputs commands without writing anything on disk.''')
     opts = parser.parse_args()
     return opts
 
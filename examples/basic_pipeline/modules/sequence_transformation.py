@@ -25,5 +25,5 @@ def reverse(splitted, **kwargs):
         }
 
     cmd = f"""
-    python bin/reverse_sequences.py {input_['sequences']} {output['reversed']}
+    python bin/reverse_sequences.py '{input_['sequences']}' {output['reversed']}
 """
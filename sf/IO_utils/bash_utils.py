@@ -8,9 +8,15 @@ def color_status(status: str, l_align: int=0, r_align: int=0):
     if lstatus in ['error', 'missing output']:
         status = f"{status} ✗"
         color = '\033[31m'  # Red
+    elif lstatus in ['oom', 'timeout']:
+        status = f"{status} ✗"
+        color = '\033[35m'  # Magenta
     elif lstatus == 'done':
         status = f"{status} ✔"
         color = '\033[32m'  # Green
+    elif lstatus == 'stale':
+        status = f"{status} ↻"
+        color = '\033[93m'  # Orange (Yellow)
     elif lstatus == 'running':
         color = '\033[93m'  # Orange (Yellow)
     elif lstatus in ['pending', '']:
@@ -33,13 +39,15 @@ def color_status(status: str, l_align: int=0, r_align: int=0):
     return f"{color}{status}\033[0m"
 
 
-def tail(file_path, n=10):
+def tail(file_path, n=10, max_bytes=None):
     """
     Reads the last n lines of a file.
 
     Args:
         file_path (str): Path to the file.
         n (int): Number of lines to read from the end of the file.
+        max_bytes (int): Maximum number of bytes read from the end of the file
+            (lines starting before are not returned).
 
     Returns:
         list: The last n lines of the file.
@@ -52,6 +60,8 @@ def tail(file_path, n=10):
         lines_found = 0
 
         while file_size > 0 and lines_found <= n:
+            if max_bytes is not None and len(buffer) >= max_bytes:
+                break
             read_size = min(block_size, file_size)
             file_size -= read_size
             f.seek(file_size)
@@ -62,6 +72,8 @@ def tail(file_path, n=10):
 
         # Decode and split lines
         lines = buffer.decode(errors='ignore').splitlines()
+        if file_size > 0 and lines_found <= n:
+            lines = lines[1:]  # first line is truncated
 
     # Return the last n lines
     return lines[-n:]
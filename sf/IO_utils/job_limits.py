@@ -0,0 +1,217 @@
+"""
+Enforcement of the memory and time declared by the jobs run by
+`sf.scheduler.Scheduler` (Linux only).
+
+Memory is limited by the kernel when a cgroup v2 subtree with the memory
+controller can be delegated to the scheduler (each job gets its own leaf with
+`memory.max` set, and the jobs killed by the OOM killer are read from
+`memory.events`). Otherwise the resident memory of the process tree of each
+job is sampled from `/proc`, and jobs above their limit are killed.
+
+Jobs running longer than their declared time get a SIGTERM, and a SIGKILL
+after a grace period. Jobs are started in their own session, so signals reach
+all the processes they started.
+"""
+
+import os
+import signal
+
+from sf.IO_utils.monitor_tasks import read_stats, read_rss, process_tree
+
+CGROUP_MOUNT = '/sys/fs/cgroup'
+
+
+def _write(path: str, value: str) -> None:
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write(value)
+
+
+def cgroup_root():
+    """
+    Creates a cgroup v2 directory for the jobs of this scheduler, below the
+    cgroup of the current process, with the memory controller enabled for its
+    children.
+
+    :returns: path to the directory, None if cgroups v2 are not available or
+       not delegated to the current user
+    """
+    try:
+        with open('/proc/self/cgroup', encoding='utf-8') as fh:
+            paths = [l[3:].strip() for l in fh if l.startswith('0::')]
+        if not paths:
+            return None
+        parent = os.path.join(CGROUP_MOUNT, paths[0].lstrip('/'))
+        with open(os.path.join(parent, 'cgroup.controllers'), encoding='utf-8') as fh:
+            if 'memory' not in fh.read().split():
+                return None
+        root = os.path.join(parent, f'snapflow-{os.getpid()}')
+        os.mkdir(root)
+    except OSError:
+        return None
+    try:
+        with open(os.path.join(parent, 'cgroup.subtree_control'), encoding='utf-8') as fh:
+            if 'memory' not in fh.read().split():
+                _write(os.path.join(parent, 'cgroup.subtree_control'), '+memory')
+        _write(os.path.join(root, 'cgroup.subtree_control'), '+memory')
+    except OSError:
+        os.rmdir(root)
+        return None
+    return root
+
+
+def _signal_group(pid: int, sig: int) -> None:
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class Job_limits:
+    """
+    Memory and walltime limits of running jobs.
+    """
+    def __init__(self, grace: float=10, memory_interval: float=1):
+        """
+        :param 10 grace: seconds between SIGTERM and SIGKILL for jobs over
+           their time
+        :param 1 memory_interval: seconds between two samples of the memory
+           used by jobs (only without cgroups)
+        """
+        self.grace           = grace
+        self.memory_interval = memory_interval
+        self.cgroup          = cgroup_root()
+        self.pids            = {}  # job ID: PID (also process group ID)
+        self.memory          = {}  # job ID: memory limit in kB
+        self.deadlines       = {}  # job ID: time of SIGTERM, then of SIGKILL
+        self.killed          = {}  # job ID: reason ('oom' or 'timeout')
+        self._leaves         = {}  # job ID: cgroup leaf
+        self._next_sample    = 0
+
+    def preexec(self, jid: int, mem: float):
+        """
+        Prepares the cgroup leaf of a job (if cgroups are used).
+
+        :param jid: job ID
+        :param mem: memory limit of the job in Gb (0 for none)
+
+        :returns: function to be run in the child process before the command
+           (moving it into its cgroup leaf), or None
+        """
+        if self.cgroup is None:
+            return None
+        leaf = os.path.join(self.cgroup, f'job-{jid}')
+        try:
+            os.mkdir(leaf)
+        except OSError:
+            return None
+        if mem > 0:
+            try:
+                _write(os.path.join(leaf, 'memory.max'), str(int(mem * 1024 ** 3)))
+                try:
+                    _write(os.path.join(leaf, 'memory.swap.max'), '0')
+                except FileNotFoundError:  # no swap accounting
+                    pass
+            except OSError:
+                # not limited by the cgroup: memory sampled instead (see
+                # `register`)
+                try:
+                    os.rmdir(leaf)
+                except OSError:
+                    pass
+                return None
+        self._leaves[jid] = leaf
+        procs = os.path.join(leaf, 'cgroup.procs')
+        return lambda: _write(procs, '0')
+
+    def register(self, jid: int, pid: int, mem: float, duration: float,
+                 now: float) -> None:
+        """
+        :param jid: job ID
+        :param pid: PID of the job (leader of its own process group)
+        :param mem: memory limit of the job in Gb (0 for none)
+        :param duration: time limit of the job in seconds
+        :param now: start time of the job
+        """
+        self.pids[jid] = pid
+        self.deadlines[jid] = now + duration
+        if mem > 0 and jid not in self._leaves:
+            self.memory[jid] = mem * 1024 ** 2
+
+    def check(self, now: float):
+        """
+        Kills the jobs over their limits.
+
+        :param now: current time
+
+        :returns: seconds until the next check is needed (None if no limit is
+           pending)
+        """
+        for jid, deadline in list(self.deadlines.items()):
+            if deadline > now:
+                continue
+            if jid not in self.killed:
+                self.killed[jid] = 'timeout'
+                self.deadlines[jid] = now + self.grace
+                _signal_group(self.pids[jid], signal.SIGTERM)
+            else:
+                del self.deadlines[jid]
+                self._kill(jid)
+        if self.memory and now >= self._next_sample:
+            self._next_sample = now + self.memory_interval
+            stats = read_stats()
+            for jid, limit in list(self.memory.items()):
+                rss = sum(read_rss(pid) for pid in process_tree(self.pids[jid], stats))
+                if rss > limit:
+                    self.killed[jid] = 'oom'
+                    del self.memory[jid]
+                    self.deadlines.pop(jid, None)
+                    self._kill(jid)
+        wake_ups = list(self.deadlines.values())
+        if self.memory:
+            wake_ups.append(self._next_sample)
+        return max(0, min(wake_ups) - now) if wake_ups else None
+
+    def _kill(self, jid: int) -> None:
+        if jid in self._leaves:
+            try:  # also kills processes that left the process group
+                _write(os.path.join(self._leaves[jid], 'cgroup.kill'), '1')
+                return
+            except OSError:  # kernels older than 5.14
+                pass
+        _signal_group(self.pids[jid], signal.SIGKILL)
+
+    def release(self, jid: int):
+        """
+        Forgets a finished job.
+
+        :returns: the reason why the job was killed ('oom' or 'timeout'), None
+           if it was not
+        """
+        reason = self.killed.pop(jid, None)
+        if reason is not None:
+            # processes of the job that outlived its main process
+            self._kill(jid)
+        self.pids.pop(jid, None)
+        self.memory.pop(jid, None)
+        self.deadlines.pop(jid, None)
+        leaf = self._leaves.pop(jid, None)
+        if leaf is not None:
+            try:
+                with open(os.path.join(leaf, 'memory.events'), encoding='utf-8') as fh:
+                    events = dict(l.split() for l in fh)
+                if int(events.get('oom_kill', 0)):
+                    reason = 'oom'
+            except OSError:
+                pass
+            try:
+                os.rmdir(leaf)
+            except OSError:  # some process left behind
+                pass
+        return reason
+
+    def close(self) -> None:
+        if self.cgroup is not None:
+            try:
+                os.rmdir(self.cgroup)
+            except OSError:
+                pass
@@ -0,0 +1,184 @@
+"""
+Append-only journal of the jobs started and ended by `sf.scheduler.Scheduler`,
+to resume a run after the scheduler was killed.
+
+Each event is a JSON object on its own line, written to the file as soon as
+it happens (so it survives the scheduler being killed), and synced to disk in
+batches (at most once per `sync_interval` seconds, to survive a crash of the
+machine without an fsync per job).
+"""
+
+import os
+import re
+import json
+import hashlib
+from time import time
+
+# working directory of the jobs generated by `Process_dict.write_commands`
+_WORKDIR = re.compile(r'(\S+)/\.command\.sh\b')
+
+
+def jobs_digest(jobs: dict) -> str:
+    """
+    :returns: digest identifying a list of jobs (IDs, names and commands)
+    """
+    digest = hashlib.sha1()
+    for jid in sorted(jobs):
+        digest.update(f"{jid}\t{jobs[jid]['name']}\t{jobs[jid]['cmd']}\n".encode())
+    return digest.hexdigest()
+
+
+def job_workdir(job: dict):
+    """
+    :returns: working directory of a job running a SnapFlow process (where its
+       `.done`/`.error` markers are written), None for other commands
+    """
+    match = _WORKDIR.search(job['cmd'])
+    return match.group(1) if match else None
+
+
+def process_start_time(pid: int):
+    """
+    :returns: start time of a process (in clock ticks since boot, to tell it
+       apart from a later process reusing its PID), None if it does not exist
+       (or already ended, not yet reaped)
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as fh:
+            stat = fh.read()
+    except OSError:
+        return None
+    fields = stat[stat.rfind(b')') + 2:].split()
+    if fields[0] in (b'Z', b'X'):
+        return None
+    return int(fields[19])
+
+
+def marker_status(job: dict):
+    """
+    :returns: 'done' or 'error' from the markers left by the job in its working
+       directory, None if there is none (or the job is not a SnapFlow process)
+    """
+    workdir = job_workdir(job)
+    if workdir is None:
+        return None
+    if os.path.exists(os.path.join(workdir, '.done')):
+        return 'done'
+    if os.path.exists(os.path.join(workdir, '.error')):
+        return 'error'
+    return None
+
+
+class Journal:
+    """
+    Journal of a scheduler run.
+    """
+    def __init__(self, path: str, jobs: dict, sync_interval: float=1):
+        """
+        :param path: path to the journal (appended to if it exists)
+        :param jobs: dictionary of jobs as returned by `parse_jobs`
+        :param 1 sync_interval: maximum time in seconds between writing an
+           event and syncing it to disk
+        """
+        self.path          = path
+        self.digest        = jobs_digest(jobs)
+        self.sync_interval = sync_interval
+        self._fd           = None
+        self._unsynced     = None  # time of the first event not synced
+
+    def replay(self) -> dict:
+        """
+        Reads the events of previous runs of the same list of jobs.
+
+        :returns: dictionary with, for each job ID, its last event (with keys
+           'event' ('start' or 'end'), 'pid' and 'pstart' for started jobs,
+           'status' for ended ones). Empty if there is no journal, or if it is
+           the one of another list of jobs (it is then moved to `path.old`).
+        """
+        last = {}
+        try:
+            with open(self.path, encoding='utf-8') as fh:
+                lines = fh.readlines()
+        except FileNotFoundError:
+            return last
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:  # truncated last line
+                continue
+        if not events or events[0].get('digest') != self.digest:
+            os.replace(self.path, f'{self.path}.old')
+            return {}
+        for event in events[1:]:
+            last[event['jid']] = event
+        return last
+
+    def open(self) -> None:
+        new = not os.path.exists(self.path)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if new:
+            self.write({'event': 'jobs', 'digest': self.digest})
+            self.sync()
+
+    def write(self, event: dict) -> None:
+        os.write(self._fd, json.dumps(event, separators=(',', ':')).encode() + b'\n')
+        if self._unsynced is None:
+            self._unsynced = time()
+        elif time() - self._unsynced >= self.sync_interval:
+            self.sync()
+
+    def started(self, jid: int, pid: int) -> None:
+        self.write({'event': 'start', 'jid': jid, 'pid': pid,
+                    'pstart': process_start_time(pid), 'time': round(time(), 1)})
+
+    def ended(self, jid: int, status: str) -> None:
+        self.write({'event': 'end', 'jid': jid, 'status': status,
+                    'time': round(time(), 1)})
+
+    def sync(self) -> None:
+        os.fsync(self._fd)
+        self._unsynced = None
+
+    def next_sync(self):
+        """
+        Syncs the events written if they waited long enough.
+
+        :returns: seconds until the next sync is due (None if all events are
+           synced)
+        """
+        if self._unsynced is None:
+            return None
+        wait = self._unsynced + self.sync_interval - time()
+        if wait <= 0:
+            self.sync()
+            return None
+        return wait
+
+    def close(self) -> None:
+        if self._fd is not None:
+            self.sync()
+            os.close(self._fd)
+            self._fd = None
+
+
+class Adopted:
+    """
+    Job started by a previous run of the scheduler and still running (not a
+    child of the current one). Mimics the `Popen` methods used by the
+    scheduler, its return code is read from the markers in its working
+    directory.
+    """
+    def __init__(self, pid: int, job: dict):
+        self.pid = pid
+        self.job = job
+
+    def poll(self):
+        if process_start_time(self.pid) is None:
+            return self.wait()
+        return None
+
+    def wait(self) -> int:
+        # jobs that are not SnapFlow processes are considered failed, as their
+        # result can not be known
+        return 0 if marker_status(self.job) == 'done' else 1
@@ -0,0 +1,198 @@
+#! /usr/bin/env python
+"""
+Lightweight sampler of the CPU and memory used by a process and all its
+descendants (Linux only, standard library only: it is run inside the jobs).
+
+At each interval, a single pass over `/proc` reads the `stat` file of every
+process (to rebuild the process tree and get CPU ticks), and the `status` file
+of the processes in the tree (resident memory). When the monitored process
+exits, the stop file is created or the sampler receives SIGTERM, a JSON
+summary is written with the peak and average CPU (in % of one CPU) and RSS (in
+kB), and a compact time series of both.
+"""
+
+import os
+import json
+import signal
+import argparse
+from time import monotonic, sleep
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+# maximum number of points kept in the time series (older samples are
+# decimated when it is reached)
+MAX_POINTS = 256
+
+
+def read_stats() -> dict:
+    """
+    :returns: dictionary per PID of (parent PID, CPU ticks), CPU ticks
+       including the ones of children already waited for
+    """
+    stats = {}
+    with os.scandir('/proc') as entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry.name}/stat', 'rb') as fh:
+                    stat = fh.read()
+            except OSError:  # process ended
+                continue
+            # the command name (2nd field) may contain spaces
+            fields = stat[stat.rfind(b')') + 2:].split()
+            stats[int(entry.name)] = (int(fields[1]),
+                                      sum(int(v) for v in fields[11:15]))
+    return stats
+
+
+def read_rss(pid: int) -> int:
+    """
+    :returns: resident memory of a process in kB (0 if it ended)
+    """
+    try:
+        with open(f'/proc/{pid}/status', 'rb') as fh:
+            for line in fh:
+                if line.startswith(b'VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree(root: int, stats: dict, exclude: int=None) -> list:
+    """
+    :returns: list of PIDs of the process and all its descendants (without the
+       `exclude` process and its descendants)
+    """
+    children = {}
+    for pid, (ppid, _) in stats.items():
+        children.setdefault(ppid, []).append(pid)
+    tree = []
+    to_visit = [root] if root in stats else []
+    while to_visit:
+        pid = to_visit.pop()
+        if pid == exclude:
+            continue
+        tree.append(pid)
+        to_visit.extend(children.get(pid, ()))
+    return tree
+
+
+class Monitor:
+    """
+    Accumulates samples of CPU and memory used by a process tree.
+    """
+    def __init__(self, pid: int, interval: float):
+        self.pid       = pid
+        self.interval  = interval
+        self.start     = monotonic()
+        self.samples   = 0
+        self.peak_cpu  = 0
+        self.sum_cpu   = 0
+        self.peak_rss  = 0
+        self.sum_rss   = 0
+        self.series    = []
+        self._stride   = 1
+        self._last     = None  # (time, CPU ticks) of the previous sample
+
+    def sample(self) -> bool:
+        """
+        :returns: False if the monitored process does not exist anymore
+        """
+        stats = read_stats()
+        tree = process_tree(self.pid, stats, exclude=os.getpid())
+        if not tree:
+            return False
+        now = monotonic()
+        ticks = sum(stats[pid][1] for pid in tree)
+        rss = sum(read_rss(pid) for pid in tree)
+        if self._last is not None and now > self._last[0]:
+            cpu = max(0, ticks - self._last[1]) / CLOCK_TICKS / (now - self._last[0]) * 100
+        else:
+            cpu = 0
+        self._last = (now, ticks)
+        self.samples  += 1
+        self.sum_cpu  += cpu
+        self.sum_rss  += rss
+        self.peak_cpu  = max(self.peak_cpu, cpu)
+        self.peak_rss  = max(self.peak_rss, rss)
+        if self.samples % self._stride == 0:
+            self.series.append((round(now - self.start, 1), round(cpu, 1), rss))
+            if len(self.series) >= MAX_POINTS:
+                self.series = self.series[::2]
+                self._stride *= 2
+        return True
+
+    def summary(self) -> dict:
+        samples = max(1, self.samples)
+        return {
+            'interval'      : self.interval,
+            'samples'       : self.samples,
+            'duration'      : round(monotonic() - self.start, 1),
+            'peak_cpu'      : round(self.peak_cpu, 1),
+            'average_cpu'   : round(self.sum_cpu / samples, 1),
+            'peak_rss_kb'   : self.peak_rss,
+            'average_rss_kb': round(self.sum_rss / samples),
+            # time (s), CPU (%), RSS (kB)
+            'series'        : self.series,
+            }
+
+
+def monitor(pid: int, interval: float, outfile: str, stopfile: str=None) -> None:
+    mon = Monitor(pid, interval)
+    stopped = []
+    signal.signal(signal.SIGTERM, lambda *_: stopped.append(True))
+
+    def _stop() -> bool:
+        return bool(stopped) or (stopfile is not None and os.path.exists(stopfile))
+
+    # sampled at least once, even if the stop file is already there
+    while mon.sample():
+        # the stop file is checked more often than samples are taken
+        end = monotonic() + interval
+        while monotonic() < end and not _stop():
+            sleep(min(0.1, interval))
+        if _stop():
+            break
+    tmp = f'{outfile}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as out:
+        json.dump(mon.summary(), out, separators=(',', ':'))
+    os.replace(tmp, outfile)
+
+
+def main():
+    opts = get_options()
+    monitor(opts.pid, opts.interval, opts.outfile, opts.stopfile)
+
+
+class CustomHelpFormatter(argparse.ArgumentDefaultsHelpFormatter):
+    def _get_help_string(self, action):
+        # Only show default if it's not None
+        if action.default is not None and action.default != argparse.SUPPRESS:
+            return super()._get_help_string(action)
+        return action.help
+
+
+def get_options():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=CustomHelpFormatter)
+
+    parser.add_argument('-p', dest='pid', metavar='PID', type=int,
+                        required=True,
+                        help='PID of the process to monitor')
+    parser.add_argument('-o', metavar='PATH', dest='outfile', required=True,
+                        help='Path to output file to store measurements.')
+    parser.add_argument('-i', dest='interval', metavar='SECONDS', type=float,
+                        default=1.0,
+                        help='Time between two samples.')
+    parser.add_argument('-s', metavar='PATH', dest='stopfile',
+                        help='Stop sampling once this file exists.')
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
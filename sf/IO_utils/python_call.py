@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+"""
+Execution of processes backed by a Python callable (see `sf.Python_call`).
+
+The call (module, name and arguments of the function) is stored in the
+`.call.pkl` file of the working directory of the process. It can be run:
+ - by its `.command.sh`, which calls this script (a copy of it is placed in
+   the results directory) with the path to `.call.pkl`: a new interpreter is
+   started for each process, it works with any batch system.
+ - by `run_process`, in a persistent worker (e.g. the pool of
+   `snap_scheduler --python_workers`): modules are imported once per worker,
+   and the same markers as `.command.sh` are written (`.running`, `.done` or
+   `.error`, `.usage`, output files and signature).
+
+Standard library only: it is also run inside the jobs.
+"""
+
+import os
+import sys
+import pickle
+import importlib
+import traceback
+import subprocess
+from time import monotonic
+
+
+def load_call(path: str):
+    """
+    :returns: dictionary describing a call (module, root, name, args, kwargs,
+       in_process, publish), None if the file can not be read
+    """
+    try:
+        with open(path, 'rb') as fh:
+            return pickle.load(fh)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def import_module(root: str, module: str):
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    return importlib.import_module(module)
+
+
+def preload(modules) -> None:
+    """
+    Imports modules (used as initializer of worker processes)
+
+    :param modules: list of (root directory, module name)
+    """
+    for root, module in modules:
+        try:
+            import_module(root, module)
+        except Exception:  # reported when the call is run
+            pass
+
+
+def call(spec: dict):
+    """
+    Runs the function described by a call.
+    """
+    function = import_module(spec['root'], spec['module'])
+    for attr in spec['name'].split('.'):
+        function = getattr(function, attr)
+    return function(*spec['args'], **spec['kwargs'])
+
+
+def _times(seconds: float) -> str:
+    # format of bash's `times`
+    return f'{int(seconds // 60)}m{seconds % 60:.3f}s'
+
+
+def run_process(workdir: str) -> int:
+    """
+    Runs the call of a process as its `.command.sh` would.
+
+    :param workdir: working directory of the process
+
+    :returns: 0 if the process succeeded, 1 otherwise
+    """
+    spec = load_call(os.path.join(workdir, '.call.pkl'))
+    marker = lambda name: os.path.join(workdir, name)
+    open(marker('.running'), 'w').close()
+    for name in ('.error', '.done', '.usage', '.profile'):
+        try:
+            os.remove(marker(name))
+        except FileNotFoundError:
+            pass
+    cwd = os.getcwd()
+    start = monotonic()
+    times = os.times()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    succeeded = False
+    try:
+        os.chdir(workdir)
+        with open(marker('.command.out'), 'wb') as out, \
+             open(marker('.command.err'), 'wb') as err:
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+            try:
+                if spec is None:
+                    raise RuntimeError(f'ERROR: can not read {marker(".call.pkl")}')
+                call(spec)
+                succeeded = True
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.dup2(saved[0], 1)
+                os.dup2(saved[1], 2)
+        elapsed = int(monotonic() - start)
+        if succeeded:
+            with open(marker('.done'), 'w') as out:
+                out.write(f'{elapsed}\n')
+        used = [a - b for a, b in zip(os.times(), times)]
+        with open(marker('.usage'), 'w') as out:
+            out.write(f'{_times(0)} {_times(0)}\n'
+                      f'{_times(used[0] + used[2])} {_times(used[1] + used[3])}\n')
+        if succeeded and spec['publish']:
+            if subprocess.run(spec['publish'], shell=True, cwd=workdir).returncode:
+                os.remove(marker('.done'))
+                succeeded = False
+        if succeeded and os.path.exists(marker('.signature.next')):
+            os.replace(marker('.signature.next'), marker('.signature'))
+    finally:
+        for fd in saved:
+            os.close(fd)
+        os.chdir(cwd)
+        os.remove(marker('.running'))
+    if not succeeded:
+        with open(marker('.error'), 'w') as out:
+            out.write(f'{int(monotonic() - start)}\n')
+    return 0 if succeeded else 1
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit(f'usage: {sys.argv[0]} PATH_TO_CALL_PKL')
+    spec = load_call(sys.argv[1])
+    if spec is None:
+        sys.exit(f'ERROR: can not read {sys.argv[1]}')
+    call(spec)
+
+
+if __name__ == "__main__":
+    main()
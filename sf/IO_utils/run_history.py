@@ -0,0 +1,142 @@
+import os
+import math
+import sqlite3
+from datetime import datetime
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    rule     TEXT,
+    bucket   INTEGER,
+    process  TEXT,
+    finished INTEGER,
+    runtime  REAL,
+    cpus     INTEGER,
+    cpu_time REAL,
+    peak_mem REAL,
+    date     TEXT,
+    UNIQUE (process, finished)
+);
+CREATE INDEX IF NOT EXISTS observations_rule ON observations (rule, bucket);
+"""
+
+
+def size_bucket(nbytes: int) -> int:
+    """
+    :returns: input-size bucket (powers of two, 0 for no input)
+    """
+    return 0 if nbytes <= 0 else int(math.log2(nbytes))
+
+
+def _quantile(values: list, quantile: float) -> float:
+    # nearest-rank
+    values = sorted(values)
+    return values[max(0, math.ceil(quantile * len(values)) - 1)]
+
+
+class Run_history:
+    """
+    SQLite database with the resources used by processes that finished: run
+    time, CPU time and peak memory, keyed by rule and input-size bucket.
+
+    It can be shared between runs (e.g. different samples processed by the same
+    workflow) to right-size the resources requested by rules.
+    """
+    def __init__(self, path: str):
+        """
+        :param path: path to the SQLite file (created if it does not exist)
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, observations: list) -> None:
+        """
+        :param observations: list of dictionaries with the rule, bucket,
+           process, finished (modification time of its `.done` file, identifies
+           the run of a process, it is recorded only once), runtime (seconds),
+           cpus (requested), cpu_time (seconds, or None) and peak_mem (Gb, or
+           None)
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(o['rule'], o['bucket'], o['process'], o['finished'], o['runtime'],
+                  o['cpus'], o['cpu_time'], o['peak_mem'], now)
+                 for o in observations])
+
+    def observations(self, rule: str, bucket: int=None) -> list:
+        """
+        :returns: list of (bucket, runtime, cpus, cpu_time, peak_mem) recorded
+           for a rule (in a given bucket, and the two neighbouring ones)
+        """
+        query = ('SELECT bucket, runtime, cpus, cpu_time, peak_mem '
+                 'FROM observations WHERE rule = ?')
+        args = [rule]
+        if bucket is not None:
+            query += ' AND bucket BETWEEN ? AND ?'
+            args += [bucket - 1, bucket + 1]
+        return self.conn.execute(query, args).fetchall()
+
+    def suggestions(self, quantile: float=0.95, margin: float=0.2,
+                    min_samples: int=3) -> dict:
+        """
+        Right-sized resources for each rule and input-size bucket.
+
+        Observations of a bucket are pooled with the ones of the two
+        neighbouring buckets.
+
+        :param 0.95 quantile: quantile of the observed values used
+        :param 0.2 margin: fraction added to the quantile
+        :param 3 min_samples: minimum number of observations needed
+
+        :returns: dictionary, indexed by (rule, bucket), of dictionaries with
+           the suggested time (seconds), cpus and memory (Gb, None if peak
+           memory is not known), and the number of samples used
+        """
+        by_rule = {}
+        for row in self.conn.execute(
+                'SELECT rule, bucket, runtime, cpus, cpu_time, peak_mem FROM observations'):
+            by_rule.setdefault(row[0], []).append(row[1:])
+        suggestions = {}
+        for rule, rows in by_rule.items():
+            for bucket in set(r[0] for r in rows):
+                pool = [r for r in rows if abs(r[0] - bucket) <= 1]
+                if len(pool) < min_samples:
+                    continue
+                suggestions[rule, bucket] = _suggest(pool, quantile, margin)
+        return suggestions
+
+
+def _suggest(rows: list, quantile: float, margin: float) -> dict:
+    runtimes = [r[1] for r in rows]
+    suggestion = {
+        'time'   : max(60, math.ceil(_quantile(runtimes, quantile) * (1 + margin))),
+        'cpus'   : None,
+        'memory' : None,
+        'samples': len(rows),
+        }
+    # CPUs actually used: CPU time over run time
+    used = [r[3] / r[1] for r in rows if r[3] is not None and r[1] > 0]
+    if used:
+        suggestion['cpus'] = min(max(r[2] for r in rows),
+                                 max(1, math.ceil(_quantile(used, quantile) * (1 + margin))))
+    peaks = [r[4] for r in rows if r[4] is not None]
+    if peaks:
+        suggestion['memory'] = max(0.1, math.ceil(_quantile(peaks, quantile) *
+                                                  (1 + margin) * 10) / 10)
+    return suggestion
+
+
+def history_path(result_dir: str) -> str:
+    return os.path.join(result_dir, '_history.sqlite')
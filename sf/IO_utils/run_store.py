@@ -0,0 +1,251 @@
+import os
+import sqlite3
+from pickle   import dumps, loads
+from datetime import datetime
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value BLOB
+);
+CREATE TABLE IF NOT EXISTS processes (
+    name      TEXT PRIMARY KEY,
+    position  INTEGER,
+    rule      TEXT,
+    module    TEXT,
+    func_name TEXT,
+    family    TEXT,
+    workdir   TEXT,
+    command   TEXT,
+    status    TEXT,
+    state     BLOB
+);
+CREATE INDEX IF NOT EXISTS processes_rule   ON processes (rule);
+CREATE INDEX IF NOT EXISTS processes_family ON processes (family);
+CREATE INDEX IF NOT EXISTS processes_status ON processes (status);
+CREATE TABLE IF NOT EXISTS inputs (
+    process TEXT,
+    key     TEXT,
+    type    TEXT,
+    name    TEXT,
+    value   TEXT,
+    source  TEXT
+);
+CREATE INDEX IF NOT EXISTS inputs_process ON inputs (process);
+CREATE TABLE IF NOT EXISTS outputs (
+    process TEXT,
+    key     TEXT,
+    value   TEXT
+);
+CREATE INDEX IF NOT EXISTS outputs_process ON outputs (process);
+CREATE TABLE IF NOT EXISTS output_files (
+    process TEXT,
+    key     TEXT,
+    path    TEXT
+);
+CREATE INDEX IF NOT EXISTS output_files_process ON output_files (process);
+CREATE TABLE IF NOT EXISTS edges (
+    parent TEXT,
+    child  TEXT
+);
+CREATE INDEX IF NOT EXISTS edges_parent ON edges (parent);
+CREATE INDEX IF NOT EXISTS edges_child  ON edges (child);
+CREATE TABLE IF NOT EXISTS status_history (
+    process TEXT,
+    status  TEXT,
+    date    TEXT
+);
+CREATE INDEX IF NOT EXISTS status_history_process ON status_history (process);
+"""
+
+# attributes of Process stored in their own tables (or rebuilt on load)
+_NOT_IN_STATE = ('processes', 'input', 'output', 'resolved_outputs')
+
+
+class Run_store:
+    """
+    SQLite database holding the state of a run: processes, their inputs,
+    outputs, dependencies and the history of their status.
+
+    Unlike the pickle, it can be partially loaded (one rule, one family or one
+    status class).
+    """
+    def __init__(self, path: str):
+        """
+        :param path: path to the SQLite file (created if it does not exist)
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def save(self, processes, statuses: dict=None) -> None:
+        """
+        Writes all processes in a single transaction.
+
+        :param processes: Process_dict to store
+        :param None statuses: dictionary of status per process name. A new
+           entry is added to the status history when it differs from the last
+           stored one.
+        """
+        statuses = statuses or {}
+        previous = dict(self.conn.execute('SELECT name, status FROM processes'))
+        now = datetime.now().isoformat(timespec='seconds')
+        families = dict((name, family) for family, members in processes.families.items()
+                        for name in members)
+        with self.conn:
+            self.conn.execute('DELETE FROM processes')
+            self.conn.execute('DELETE FROM inputs')
+            self.conn.execute('DELETE FROM outputs')
+            self.conn.execute('DELETE FROM output_files')
+            self.conn.execute('DELETE FROM edges')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                [('name'       , processes.name),
+                 ('result_dir' , processes.result_dir),
+                 ('singularity', processes.singularity)])
+            self.conn.executemany(
+                'INSERT INTO processes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(name, pos, p.rule_name, p.module, p.func_name, families.get(name),
+                  p.workdir, p.command, statuses.get(name, previous.get(name)),
+                  dumps(dict((k, v) for k, v in p.__dict__.items()
+                             if k not in _NOT_IN_STATE)))
+                 for pos, (name, p) in enumerate(processes.items())])
+            self.conn.execute('DELETE FROM status_history WHERE process NOT IN '
+                              '(SELECT name FROM processes)')
+            self.conn.executemany(
+                'INSERT INTO inputs VALUES (?, ?, ?, ?, ?, ?)',
+                [(name, k, v.type, v.name, str(v.value),
+                  None if v.process is None else v.process.name)
+                 for name, p in processes.items() for k, v in p.input.items()])
+            self.conn.executemany(
+                'INSERT INTO outputs VALUES (?, ?, ?)',
+                [(name, k, v) for name, p in processes.items()
+                 for k, v in dict.items(p.output)])
+            self.conn.executemany(
+                'INSERT INTO output_files VALUES (?, ?, ?)',
+                [(name, k, path) for name, p in processes.items()
+                 for k, paths in getattr(p, 'resolved_outputs', {}).items()
+                 for path in paths])
+            self.conn.executemany(
+                'INSERT INTO edges VALUES (?, ?)',
+                [(parent, name) for name in processes
+                 for parent in processes.graph.parents[name]])
+            self.conn.executemany(
+                'INSERT INTO status_history VALUES (?, ?, ?)',
+                [(name, status, now) for name, status in statuses.items()
+                 if previous.get(name) != status])
+
+    def output_files(self, name: str) -> dict:
+        """
+        :returns: files matching each output of a process declared as a pattern
+           (as resolved when its status was last checked)
+        """
+        files = {}
+        for key, path in self.conn.execute(
+                'SELECT key, path FROM output_files WHERE process = ? ORDER BY rowid',
+                (name, )):
+            files.setdefault(key, []).append(path)
+        return files
+
+    def status_history(self, name: str) -> list:
+        """
+        :returns: list of (status, date) recorded for a process
+        """
+        return self.conn.execute(
+            'SELECT status, date FROM status_history WHERE process = ? ORDER BY rowid',
+            (name, )).fetchall()
+
+    def load(self, rule: str=None, family: str=None, status: str=None):
+        """
+        Loads processes, optionally only a subset of them.
+
+        Inputs coming from processes that are not loaded are kept, but not
+        linked to their source process.
+
+        :param None rule: only load processes of this rule
+        :param None family: only load processes of this family (processes
+           generated by the same rule function with different `replicate_name`)
+        :param None status: only load processes with this status (e.g. "Error")
+
+        :returns: a Process_dict
+        """
+        from sf import Process_dict, Process, IO_type, _Process_output
+        from sf.graph import Process_graph
+
+        where, args = [], []
+        for column, value in [('rule', rule), ('family', family), ('status', status)]:
+            if value is not None:
+                where.append(f'{column} = ?')
+                args.append(value)
+        query = 'SELECT name, family, state FROM processes'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY position'
+
+        meta = dict(self.conn.execute('SELECT key, value FROM meta'))
+        processes = Process_dict.__new__(Process_dict)
+        processes.name        = meta.get('name')
+        processes.result_dir  = meta.get('result_dir')
+        processes.singularity = meta.get('singularity', '')
+        processes.families    = {}
+        processes.graph       = Process_graph()
+        processes.set_defaults()
+
+        rows = self.conn.execute(query, args).fetchall()
+        for name, family, state in rows:
+            proc = Process.__new__(Process)
+            proc.__dict__.update(loads(state))
+            proc.processes = processes
+            proc.input     = {}
+            proc.output    = _Process_output(proc)
+            proc.resolved_outputs = {}
+            dict.__setitem__(processes, name, proc)
+            if family is not None:
+                processes.families.setdefault(family, {})[name] = proc
+
+        names = list(processes)
+        for chunk in range(0, len(names), 500):
+            subset = names[chunk:chunk + 500]
+            marks = ','.join('?' * len(subset))
+            for name, key, value in self.conn.execute(
+                    f'SELECT process, key, value FROM outputs WHERE process IN ({marks}) '
+                    'ORDER BY rowid', subset):
+                dict.__setitem__(processes[name].output, key, value)
+            for name, key, path in self.conn.execute(
+                    f'SELECT process, key, path FROM output_files WHERE process IN ({marks}) '
+                    'ORDER BY rowid', subset):
+                processes[name].resolved_outputs.setdefault(key, []).append(path)
+            for name, key, type_, io_name, value, source in self.conn.execute(
+                    f'SELECT * FROM inputs WHERE process IN ({marks}) ORDER BY rowid',
+                    subset):
+                io = IO_type.__new__(IO_type)
+                io.type    = type_
+                io.name    = io_name
+                io.value   = _cast_value(type_, value)
+                io.process = processes.get(source)
+                processes[name].input[key] = io
+        for name in names:
+            processes.graph.add(name, processes[name].dependencies)
+        return processes
+
+
+def _cast_value(type_, value):
+    if type_ == 'int':
+        return int(value)
+    if type_ == 'float':
+        return float(value)
+    return value
+
+
+def store_path(result_dir: str) -> str:
+    return os.path.join(result_dir, '_processes.sqlite')
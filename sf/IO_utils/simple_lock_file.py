@@ -1,5 +1,5 @@
 import os
-from time import time
+from time import sleep
 
 class FileLock:
     def __init__(self, target_file):
@@ -14,7 +14,7 @@ class FileLock:
                 os.close(fd)
                 break  # ready to do somthing with the locked file
             except FileExistsError:
-                time.sleep(0.1)
+                sleep(0.1)
     
     def __exit__(self, exc_type, exc_value, traceback):
         # release the lock, be happy
@@ -0,0 +1,150 @@
+import os
+import hashlib
+from fnmatch import fnmatchcase
+from glob    import glob
+from time    import time_ns
+
+
+class Status_snapshot:
+    """
+    Cached view of the files present in process working directories.
+
+    Each directory is listed once (a single `os.scandir`) and all later
+    existence checks on files inside it are answered from that listing. A
+    snapshot is meant to be used for one pass over the processes (e.g. one
+    summary), and then thrown away.
+    """
+    def __init__(self):
+        self.created      = time_ns()  # files modified later may be missed
+        self._listings    = {}
+        self._first_lines = {}
+        self._contents    = {}
+        self._stats       = {}
+        self._digests     = {}
+        self._globs       = {}
+
+    def listing(self, dirpath: str) -> frozenset:
+        """
+        :returns: names of the entries in `dirpath` (empty if it does not exist)
+        """
+        try:
+            return self._listings[dirpath]
+        except KeyError:
+            pass
+        try:
+            with os.scandir(dirpath) as entries:
+                names = frozenset(entry.name for entry in entries)
+        except (FileNotFoundError, NotADirectoryError):
+            names = frozenset()
+        self._listings[dirpath] = names
+        return names
+
+    def exists(self, path: str) -> bool:
+        dirpath, name = os.path.split(os.path.normpath(path))
+        return name in self.listing(dirpath)
+
+    def glob(self, pattern: str) -> list:
+        """
+        :param pattern: path with shell-style wildcards (`*`, `?`, `[...]`). If
+           they only appear in the file name, the pattern is matched against the
+           cached listing of the directory.
+
+        :returns: sorted list of matching paths (hidden files are only matched
+           by patterns starting with a dot)
+        """
+        try:
+            return self._globs[pattern]
+        except KeyError:
+            pass
+        dirpath, name = os.path.split(os.path.normpath(pattern))
+        if is_pattern(dirpath):
+            files = sorted(glob(pattern))
+        else:
+            files = sorted(os.path.join(dirpath, f) for f in self.listing(dirpath)
+                           if fnmatchcase(f, name) and
+                           (name.startswith('.') or not f.startswith('.')))
+        self._globs[pattern] = files
+        return files
+
+    def read_first_line(self, path: str):
+        """
+        :returns: first line of the file (stripped), or None if it does not exist
+        """
+        try:
+            return self._first_lines[path]
+        except KeyError:
+            pass
+        line = None
+        if self.exists(path):
+            try:
+                with open(path, encoding='utf-8') as fh:
+                    line = next(fh, '').strip()
+            except FileNotFoundError:
+                pass
+        self._first_lines[path] = line
+        return line
+
+    def read(self, path: str):
+        """
+        :returns: content of the file, or None if it does not exist
+        """
+        try:
+            return self._contents[path]
+        except KeyError:
+            pass
+        content = None
+        if self.exists(path):
+            try:
+                with open(path, encoding='utf-8') as fh:
+                    content = fh.read()
+            except FileNotFoundError:
+                pass
+        self._contents[path] = content
+        return content
+
+    def stat(self, path: str):
+        """
+        :returns: os.stat_result of the path, or None if it does not exist
+        """
+        try:
+            return self._stats[path]
+        except KeyError:
+            pass
+        try:
+            self._stats[path] = os.stat(path)
+        except FileNotFoundError:
+            self._stats[path] = None
+        return self._stats[path]
+
+    def mtime(self, path: str) -> int:
+        """
+        :returns: modification time of the path in nanoseconds (0 if it does
+           not exist)
+        """
+        stat = self.stat(path)
+        return 0 if stat is None else stat.st_mtime_ns
+
+    def digest(self, path: str) -> str:
+        """
+        :returns: SHA-256 of the content of a file (None if it is not a file)
+        """
+        try:
+            return self._digests[path]
+        except KeyError:
+            pass
+        if not os.path.isfile(path):
+            self._digests[path] = None
+            return None
+        sha = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for block in iter(lambda: fh.read(1 << 20), b''):
+                sha.update(block)
+        self._digests[path] = sha.hexdigest()
+        return self._digests[path]
+
+
+def is_pattern(path: str) -> bool:
+    """
+    :returns: True if the path contains shell-style wildcards
+    """
+    return any(c in str(path) for c in '*?[')
@@ -0,0 +1,57 @@
+import re
+
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def time_to_seconds(value) -> int:
+    """
+    Converts a time request into seconds.
+
+    :param value: either a number of hours (int or float, as the default `time`
+       of a rule), or a string in one of the formats accepted by Slurm
+       ("minutes", "minutes:seconds", "hours:minutes:seconds", "days-hours",
+       "days-hours:minutes" and "days-hours:minutes:seconds"), or a number with
+       a unit suffix ("30s", "10m", "2h", "1d").
+
+    :returns: number of seconds
+    """
+    if isinstance(value, (int, float)):
+        return int(value * 3600)
+    value = str(value).strip()
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhd])', value)
+    if match:
+        return int(float(match.group(1)) * _UNITS[match.group(2)])
+    days = 0
+    if '-' in value:
+        days, value = value.split('-', 1)
+        days = int(days)
+        fields = [int(v) for v in value.split(':')]
+        # with days, the first field are hours
+        fields += [0] * (3 - len(fields))
+        hours, minutes, seconds = fields
+    else:
+        fields = [int(v) for v in value.split(':')]
+        if len(fields) == 1:
+            hours, minutes, seconds = 0, fields[0], 0
+        elif len(fields) == 2:
+            hours, minutes, seconds = 0, *fields
+        elif len(fields) == 3:
+            hours, minutes, seconds = fields
+        else:
+            raise ValueError(f'ERROR: invalid time format: {value}')
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def seconds_to_time(seconds) -> str:
+    """
+    Converts a number of seconds into a time request understood by Slurm
+    ("days-hours:minutes:seconds", days omitted if zero)
+    """
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f'{days}-{hours:02d}:{minutes:02d}:{seconds:02d}'
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
@@ -1,4 +1,5 @@
 import os
+import shutil
 from yaml import Dumper, dump as dump_yaml
 import inspect
 
@@ -11,7 +12,7 @@ def get_caller_script_path():
 
 
 def create_workdir(result_dir, sample, singularity_img,
-                   singularity_binds, params):
+                   singularity_binds, params, dry_run=False):
     """
     :param result_dir: path for the global output directory
     :param sample: sample name to search for in the params dictionary (from the input YAML file)
@@ -20,6 +21,8 @@ def create_workdir(result_dir, sample, singularity_img,
     :param singularity_bind: path to a singularity bind directory (to be included
     in the singularity scope) -> this will automatically update the params dictionary
     :param params: dictionary of parameters set and parsed from the input YAML file.
+    :param False dry_run: only update the params dictionary, nothing is written
+       on disk.
     """
     params['results directory'] = result_dir
     
@@ -33,12 +36,14 @@ def create_workdir(result_dir, sample, singularity_img,
     # if os.path.exists(param_file):
     #     # already done
     #     return
-    os.system(f"mkdir -p {result_dir}")
+    if dry_run:
+        return
+    os.makedirs(result_dir, exist_ok=True)
 
     # copy executable files and scripts
     bin_path = os.path.join(get_caller_script_path(), 'bin')
     if os.path.exists(bin_path):
-        os.system(f"cp -r {bin_path} {result_dir}/")
+        shutil.copytree(bin_path, os.path.join(result_dir, 'bin'), dirs_exist_ok=True)
 
     out = open(param_file, 'w', encoding='utf-8')
     ## TODO: check if differences in parameters (e.g. singularity or versions)
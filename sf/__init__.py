@@ -1,7 +1,15 @@
 import os
 import sys
+import json
+import copy
+import heapq
+import shlex
+import asyncio
+import shutil
+import hashlib
 import functools
 from collections                  import defaultdict
+from concurrent.futures           import ThreadPoolExecutor
 from pickle                       import dump, load
 from datetime                     import timedelta
 
@@ -9,7 +17,15 @@ from sf.IO_utils.workdir          import create_workdir  # import for external s
 from sf.IO_utils.path_validation  import validate_path, make_path_absolute
 from sf.IO_utils.simple_lock_file import FileLock
 from sf.IO_utils.bash_utils       import color_status, tail
+from sf.IO_utils.status_snapshot  import Status_snapshot, is_pattern
+from sf.IO_utils.run_store        import Run_store, store_path
+from sf.IO_utils.run_history      import Run_history, history_path, size_bucket
+from sf.IO_utils.time_utils       import time_to_seconds, seconds_to_time
+from sf.IO_utils                  import monitor_tasks, python_call
 from sf                           import globals
+from sf.graph                     import Process_graph
+from sf.scheduler                 import Simulator, Dependency_tracker
+from sf.rule_capture              import capture_rule_vars
 from sf.views                     import generate_mermaid_html
 
 
@@ -20,6 +36,9 @@ def rule(func):
      - "input_": a Dictionary listing needed input files
      - "output": a Dictionary listing generated output files (should be relative path)
      - "cmd"   : the command to be executed
+    These variables can also be returned explicitly (e.g. `return locals()`),
+    which is the cheapest way for them to be collected (a rule function doing so
+    should do it in all its calls).
      
     Optionally we can also set:
      - "publish": a dictionary to copy most relevant output files to the `results` folder.
@@ -51,17 +70,8 @@ def rule(func):
             workdir = os.path.join(
                     globals.processes.result_dir, 'tmp', *modules)
         
-        rule_vars = {}
-        def tracer(frame, event, arg):
-            if event == 'return':
-                rule_vars.update(frame.f_locals)
-            return tracer
-        sys.setprofile(tracer)
-        
-        func(*args, **kwargs)
-        
-        sys.setprofile(None)
-        
+        rule_vars = capture_rule_vars(func, args, kwargs)
+
         # check all variables are created:
         diff = set(['input_', 'output', 'cmd']).difference(rule_vars)
         if diff:
@@ -74,6 +84,7 @@ def rule(func):
                        processes=globals.processes, publish=rule_vars.get('publish'),
                        **kwargs)
         globals.processes[name] = proc
+        globals.processes.apply_history(proc)
         
         # define sisters: processes using the same function
         # (in order to ease the retrieval of outputs)
@@ -93,7 +104,50 @@ def rule(func):
         wrapper.__doc__ += doc
     return wrapper
 
+
+def scatter(process, key: str, child_rule, gather=None, gather_kwargs: dict=None,
+            **kwargs) -> 'Scatter':
+    """
+    Dynamic fan-out: calls a rule once per file of an output of a process
+    declared as a pattern (e.g. "seq_*"), when these files are known.
+
+    If the process is already done, the processes are created right away.
+    Otherwise they are created when it ends successfully in
+    `Process_dict.run`, or when the workflow is planned again (they are not
+    part of the jobs written by `write_commands` until then).
+
+    :param process: process generating the files
+    :param key: name of its output
+    :param child_rule: rule function called with the input of one of the
+       files (see `IO_type.item`), with `replicate_name` extended by the name
+       of the file
+    :param None gather: rule function called with the list of processes
+       created by `child_rule` (it should depend on all of them)
+    :param None gather_kwargs: parameters of the gather rule call (by default
+       the same `replicate_name` as the scatter)
+    :param kwargs: parameters of the `child_rule` calls (e.g. `time`)
+
+    :returns: a Scatter
+    """
+    fan_out = Scatter(process, key, child_rule, gather, gather_kwargs or {}, kwargs)
+    if process.is_done() and not process.is_stale():
+        fan_out.expand()
+    else:
+        globals.processes.scatters.append(fan_out)
+    return fan_out
+
 class IO_type:
+    """
+    Input of a process: a value of a given type ('path', 'int', 'float' or
+    'str'), or an output of another process (`process` and the name of its
+    output as `value`).
+
+    Outputs of other processes can also be read as a 'stream': the output is
+    then a named pipe, and both processes run at the same time (in the same
+    job), the data flowing between them without being written on disk. A
+    stream is read by a single process. If one of the processes connected by
+    streams fails, all are marked as failed.
+    """
     def __init__(self, type_: str, value, process=None) -> None:
         self.type = type_
         self.process = process
@@ -108,7 +162,38 @@ class IO_type:
     def __repr__(self) -> str:
         return self.value
 
+    def files(self, snapshot: Status_snapshot=None) -> list:
+        """
+        Concrete list of files of a path. For outputs of other processes
+        declared as patterns (e.g. "seq_*"), it is the list of files resolved
+        when the status of that process was last checked (and it is only
+        resolved here otherwise).
+
+        :param None snapshot: Status_snapshot to use if files need to be resolved
+        """
+        if not is_pattern(self.value):
+            return [self.value]
+        if self.process is not None:
+            return self.process.resolve_output(self.name, snapshot)
+        return (snapshot or Status_snapshot()).glob(self.value)
+
+    def item(self, path: str) -> 'IO_type':
+        """
+        :param path: one of the files of the output of a process declared as a
+           pattern
+
+        :returns: input of that file only (still depending on the process)
+        """
+        item = copy.copy(self)
+        item.value = path
+        return item
+
     def validate(self):
+        if self.type == "stream":
+            if self.process is None:
+                return False
+            validate_path(self.value, directory=True)
+            return True
         if self.process is None and self.type == "path":
             self.value = os.path.abspath(self.value)
             return os.path.exists(self.value)
@@ -130,16 +215,125 @@ class IO_type:
         return True
 
 
+class Python_call:
+    """
+    Command of a rule running a Python function instead of a shell command
+    (e.g. `cmd = Python_call(reverse_sequences, input_['sequences'], 'out.fa')`).
+
+    The function should be defined at the top level of an importable module
+    (not in the workflow script), arguments should be picklable, `IO_type`
+    arguments are replaced by their value. The function runs in the working
+    directory of the process, and fails if it raises an exception.
+
+    Processes with no `env`, no container and no profiling can be run by the
+    persistent Python workers of `snap_scheduler --python_workers`, without
+    starting a new interpreter for each process.
+    """
+    def __init__(self, function, *args, **kwargs):
+        if '<locals>' in function.__qualname__ or function.__module__ == '__main__':
+            raise TypeError(f'ERROR: {function.__qualname__} should be defined at '
+                            'the top level of an importable module')
+        module = sys.modules[function.__module__]
+        # directory from which the module can be imported
+        root = os.path.abspath(module.__file__)
+        for _ in function.__module__.split('.'):
+            root = os.path.dirname(root)
+        if os.path.basename(module.__file__) == '__init__.py':
+            root = os.path.dirname(root)
+        self.module = function.__module__
+        self.root   = root
+        self.name   = function.__qualname__
+        self.args   = tuple(a.value if isinstance(a, IO_type) else a for a in args)
+        self.kwargs = dict((k, v.value if isinstance(v, IO_type) else v)
+                           for k, v in kwargs.items())
+
+    def __repr__(self) -> str:
+        args = [repr(a) for a in self.args] + [f'{k}={v!r}' for k, v in self.kwargs.items()]
+        return f"{self.module}.{self.name}({', '.join(args)})"
+
+
+class Scatter:
+    """
+    Rule called once per file of an output of a process, created when the
+    files are known (see `scatter`).
+    """
+    def __init__(self, process, key: str, child_rule, gather, gather_kwargs: dict,
+                 kwargs: dict):
+        self.process       = process
+        self.key           = key
+        self.child_rule    = child_rule
+        self.gather        = gather
+        self.gather_kwargs = gather_kwargs
+        self.kwargs        = kwargs
+        self.children      = []
+        self.gathered      = None  # process created by the gather rule
+
+    def expand(self) -> list:
+        """
+        Creates the processes of the files of the output (and the gather
+        process).
+
+        :returns: names of the processes created, in topological order
+        """
+        self.process.check_output(Status_snapshot())  # files written since planned
+        source = IO_type('path', self.key, self.process)
+        base = self.kwargs.get('replicate_name')
+        for path in self.process.resolve_output(self.key):
+            stem = os.path.basename(path)
+            kwargs = dict(self.kwargs, replicate_name=f'{base}.{stem}' if base else stem)
+            self.children.append(self.child_rule(source.item(path), **kwargs))
+        created = [child.name for child in self.children]
+        if self.gather is not None:
+            kwargs = dict(self.gather_kwargs)
+            if base is not None:
+                kwargs.setdefault('replicate_name', base)
+            self.gathered = self.gather(self.children, **kwargs)
+            created.append(self.gathered.name)
+        return created
+
+
 class Process_dict(dict):
     """
     Global dictionary to keep track of the processes to be executed.
     
     It takes as parameter a dictionary of parameters.
     """
-    def __init__(self, params: dict, name=None, *args, **kwargs):
+    def __init__(self, params: dict, name=None, *args, run_store: str='pickle',
+                 hash_inputs: bool=False, lazy_fs: bool=False, dry_run: bool=False,
+                 fs_workers: int=1, history: str=None, resources: str='declared',
+                 profile: float=0, **kwargs):
         """
         :param params: dictionary of parameters
+        :param 'pickle' run_store: how to save the state of the run in the
+           results directory, either 'pickle' (_processes.pkl) or 'sqlite'
+           (_processes.sqlite, can be partially loaded with `Run_store`).
+        :param False hash_inputs: use the content hash of input files (instead
+           of their size and modification time) to detect if they changed.
+        :param False lazy_fs: directories of processes (working directories and
+           publish destinations) are only recorded while planning, and created
+           all at once when writing commands (see `create_directories`).
+        :param False dry_run: nothing is written on disk, `write_commands` only
+           prints the commands.
+        :param 1 fs_workers: number of threads used to create the recorded
+           directories.
+        :param None history: path to the SQLite file where the resources used
+           by finished processes are recorded (see `Run_history`), by default
+           `_history.sqlite` in the results directory. It can be shared by
+           several runs.
+        :param 'declared' resources: resources requested by processes: either
+           the ones declared in the rule calls ('declared'), the same but
+           keeping the ones learnt from the history as `Process.suggested`
+           ('suggest'), or the learnt ones when available ('auto').
+        :param 0 profile: if set, each job samples every `profile` seconds the
+           CPU and memory used by its processes, and writes a summary with a
+           time series in `.profile` (see `sf.IO_utils.monitor_tasks`).
         """
+        if run_store not in ('pickle', 'sqlite'):
+            raise ValueError(f"ERROR: unknown run_store '{run_store}', "
+                             "should be 'pickle' or 'sqlite'")
+        if resources not in ('declared', 'suggest', 'auto'):
+            raise ValueError(f"ERROR: unknown resources '{resources}', "
+                             "should be 'declared', 'suggest' or 'auto'")
         self.update(*args, **kwargs)
         if params.get('with-singularity', None) is not None:
             if  params.get('singularity-bind', None) is not None:
@@ -154,8 +348,29 @@ class Process_dict(dict):
         
         self.name = name
 
+        self.run_store = run_store
+
+        self.hash_inputs = hash_inputs
+
+        self.lazy_fs    = lazy_fs or dry_run
+        self.dry_run    = dry_run
+        self.fs_workers = fs_workers
+
+        self.history   = history_path(self.result_dir) if history is None else history
+        self.resources = resources
+
+        self.profile   = profile
+        # resources learnt from the history, per (rule, input-size bucket)
+        self._suggestions = None
+        # directories to be created before writing commands (with lazy_fs)
+        self._pending_dirs = set()
+
         # to hold conversion table -> useful for meta-processes (1 job, several commands)
         self.families = {}
+        # dynamic fan-outs waiting for their process to be done (see `scatter`)
+        self.scatters = []
+        # index of dependencies between processes
+        self.graph = Process_graph()
         globals.processes = self
 
     def __setitem__(self, key, process):
@@ -168,11 +383,46 @@ class Process_dict(dict):
         except AttributeError:
             pass
         dict.__setitem__(self, key, process)
+        try:
+            self.graph.add(key, process.dependencies)
+        except AttributeError:  # unpickling: graph is restored with the state
+            pass
 
     def __getitem__(self, key):
         return dict.__getitem__(self, key)
+
+    def __getstate__(self):
+        # pending fan-outs hold rule functions (the workflow modules may not be
+        # importable where the state is loaded), they are recreated when the
+        # workflow is planned
+        state = dict(self.__dict__)
+        state['scatters'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.set_defaults()
+        if 'graph' not in state:  # pickled by an older version
+            self.graph = Process_graph()
+            for name, process in self.items():
+                self.graph.add(name, process.dependencies)
     
-    def write_commands(self, sequential: bool=True) -> None:
+    def set_defaults(self) -> None:
+        """
+        Sets the attributes that are not part of a saved state (pickled by an
+        older version, or loaded from a `Run_store`) to their default value.
+        """
+        for key, value in [('hash_inputs', False), ('lazy_fs', False),
+                           ('dry_run', False), ('fs_workers', 1),
+                           ('_pending_dirs', set()),
+                           ('history', history_path(self.result_dir)),
+                           ('resources', 'declared'), ('_suggestions', None),
+                           ('profile', 0), ('scatters', [])]:
+            self.__dict__.setdefault(key, value)
+
+    def write_commands(self, sequential: bool=True, batch_size: int=1,
+                       batch_parallel: int=1, batch_by: str='family',
+                       arrays: bool=False, priority: bool=False) -> None:
         """
         Write commands in stdout
         
@@ -180,39 +430,729 @@ class Process_dict(dict):
            about dependencies or number of cpus... They can be run directly in a
            sequential manner. Otherwise they will be printed preceded by a string 
            between brackets containing process specifications.
+        :param 1 batch_size: maximum number of processes packed in a single job
+           (meta-process). Each process of a batch keeps its own working
+           directory and status files.
+        :param 1 batch_parallel: number of processes of a batch run at the same
+           time inside the job (the job requests the resources accordingly).
+        :param 'family' batch_by: processes packed together are either members
+           of the same family ('family'), or any processes with the same
+           resource request ('resources').
+        :param False arrays: members of a family are emitted as a single job
+           array, with an index-to-script mapping file. Dependencies between
+           arrays whose tasks depend one-to-one are written as "depe-corr"
+           (task N waits for task N of the other array). Not compatible with
+           `sequential` nor with `batch_size`.
+        :param False priority: add a priority field to each job: the length in
+           seconds of the longest chain of processes remaining from it (jobs
+           with the highest priority should be run first).
         """
-        pid = 1
-        for name, process in self.items():
-            # TODO: write memory
-            # # (memory per cpu should be written in order to compute number of cpus needed)
-            if process.is_done():
-                continue
-            dependencies = []
-            for dep in process.dependencies:
-                try:
-                    dependencies.append(str(self[dep].pid))
-                except AttributeError:  # dependency already satisfied
-                    continue
-            process.pid = pid
-            if not process.is_done():
-                process.format_executable()
+        if batch_by not in ('family', 'resources'):
+            raise ValueError(f"ERROR: unknown batch_by '{batch_by}', "
+                             "should be 'family' or 'resources'")
+        if arrays and (sequential or batch_size > 1):
+            raise ValueError('ERROR: job arrays can not be combined with '
+                             'sequential output nor with batches')
+        if arrays:
+            batch_size, batch_by = float('inf'), 'family'
+        self.create_directories()
+        if not self.dry_run:
+            self._copy_helpers()
+        snapshot = Status_snapshot()
+        to_run = self.find_processes_to_run(snapshot)
+        if not self.dry_run:
+            for name in self.graph.topological_order():
+                if name not in to_run:
+                    self[name].adopt_signature(snapshot)
+        gangs = self.gangs()
+        jobs = self._pack_jobs([n for n in self.graph.topological_order() if n in to_run],
+                               batch_size, batch_by, gangs)
+        job_of = dict((name, jid) for jid, members in enumerate(jobs, 1)
+                      for name in members)
+        if priority:
+            _, latest = self.start_times(job_of)
+            end = max((latest[n] + time_to_seconds(self[n].time) for n in latest),
+                      default=0)
+        for jid, members in enumerate(jobs, 1):
+            # dependencies already satisfied are not listed
+            dependencies = sorted(set(job_of[dep] for name in members
+                                      for dep in self.graph.parents[name]
+                                      if dep in job_of) - set([jid]))
+            array = ''
+            if not self.dry_run:
+                for name in members:
+                    self[name].format_executable()
+            process = self[members[0]]
+            container = process.singularity
+            if len(members) == 1:
+                name   = members[0]
+                cpus   = process.cpus
+                memory = process.memory
+                ptime  = seconds_to_time(time_to_seconds(process.time))
+                script = os.path.join(process.workdir, '.command.sh')
+            elif members[0] in gangs:
+                name   = f"{process.func_name}_gang{jid}"
+                # each member is run in its own container by the script
+                container = ''
+                cpus   = sum(self[m].cpus for m in members)
+                memory = sum(self[m].memory for m in members)
+                ptime  = seconds_to_time(max(time_to_seconds(self[m].time)
+                                             for m in members))
+                script = self._write_gang_script(name, members)
+            elif arrays:
+                name   = process.func_name
+                # per task, members of a family may request different resources
+                cpus   = max(self[m].cpus for m in members)
+                memory = max(self[m].memory for m in members)
+                ptime  = seconds_to_time(max(time_to_seconds(self[m].time)
+                                             for m in members))
+                script, array_map = self._write_array_script(f'{name}_{jid}', members)
+                corr = [d for d in dependencies
+                        if self._one_to_one(members, jobs[d - 1])]
+                dependencies = [d for d in dependencies if d not in corr]
+                array = f";array 1-{len(members)};array-map {array_map}"
+                if corr:
+                    array += f";depe-corr {','.join(str(d) for d in corr)}"
+            else:
+                parallel = min(batch_parallel, len(members))
+                name   = f"{process.func_name}_batch{jid}"
+                cpus   = max(self[m].cpus for m in members) * parallel
+                # the `parallel` largest requests may run at the same time
+                memory = sum(sorted((self[m].memory for m in members),
+                                    reverse=True)[:parallel])
+                ptime  = seconds_to_time(max(time_to_seconds(self[m].time)
+                                             for m in members) *
+                                         -(-len(members) // parallel))
+                script = self._write_batch_script(name, members, parallel)
             if dependencies:
-                dependencies = f";depe {','.join(dependencies)}"
+                dependencies = f";depe {','.join(str(d) for d in dependencies)}"
             else:
                 dependencies = ''
+            if priority:
+                rank = f";priority {max(end - latest[n] for n in members)}"
+            else:
+                rank = ''
             if sequential:
                 prefix = ''
             else:
                 prefix = ("["
                         f"name {name.replace(' ', '_')};"
-                        f"cpus-per-task {process.cpus};"
-                        f"time {process.time}"
+                        f"rule {process.func_name};"
+                        f"cpus-per-task {cpus};"
+                        f"mem {float(memory):g};"
+                        f"time {ptime}"
+                        f"{array}"
                         f"{dependencies}"
-                        f"] {process.singularity} ")
-            print(prefix + f"/bin/bash {os.path.join(process.workdir, '.command.sh')}")
-            pid += 1
+                        f"{rank}"
+                        f"] {container} ")
+            print(prefix + f"/bin/bash {script}")
+        for fan_out in self.scatters:
+            sys.stderr.write(f"WARNING: processes scattered from {fan_out.process.name} "
+                             "will be created once it is done: plan the workflow again "
+                             "then (or use Process_dict.run)\n")
+        if not self.dry_run:
+            self.generate_summary(verbose=False, snapshot=snapshot)
+
+    def run(self, max_cpus: int=None, max_mem: float=None, callback=None) -> dict:
+        """
+        Runs the processes on this machine, directly from the graph of
+        processes (without writing the list of jobs): each process is launched
+        as soon as its dependencies are done and it fits in the CPUs and memory
+        available (processes with the earliest latest start first, see
+        `start_times`). Only the processes that need to be run are (see
+        `find_processes_to_run`).
+
+        From a running event loop (e.g. in a notebook), await `run_async`
+        instead.
+
+        :param None max_cpus: number of CPUs to use (by default all the CPUs of
+           the machine)
+        :param None max_mem: memory to use in Gb (unlimited by default)
+        :param None callback: function called with the name of a process and
+           its new status ('running', 'done', 'error' or 'unsatisfiable') each
+           time it changes
+
+        :returns: dictionary with the final status of each process run
+        """
+        return asyncio.run(self.run_async(max_cpus, max_mem, callback))
+
+    async def run_async(self, max_cpus: int=None, max_mem: float=None,
+                        callback=None) -> dict:
+        """
+        Coroutine version of `run`. If it is cancelled, running processes are
+        terminated (and marked as failed).
+        """
+        if self.dry_run:
+            raise ValueError('ERROR: processes can not be run with dry_run')
+        cpus = os.cpu_count() if max_cpus is None else max_cpus
+        mem  = float('inf') if max_mem is None else max_mem
+        self.create_directories()
+        self._copy_helpers()
+        snapshot = Status_snapshot()
+        to_run = self.find_processes_to_run(snapshot)
+        for name in self.graph.topological_order():
+            if name not in to_run:
+                self[name].adopt_signature(snapshot)
+        order = self._analysis_order(to_run)
+        for name in order:
+            self[name].format_executable()
+        jobs = self._jobs(order, max_mem is not None)
+        _, latest = self.start_times(to_run)
+        tracker = Dependency_tracker(jobs, dict((jid, min(latest[n] for n in job['members']))
+                                                for jid, job in jobs.items()))
+        jid_of = dict((name, jid) for jid, job in jobs.items() for name in job['members'])
+        reported = {}
+
+        def _notify(jids) -> None:
+            for jid in jids:
+                status = jobs[jid]['status']
+                if reported.get(jid) != status:
+                    reported[jid] = status
+                    if callback is not None:
+                        for name in jobs[jid]['members']:
+                            callback(name, status)
+
+        def _fail(jid: int) -> None:
+            tracker.fail(jid)
+            _notify([jid] + [jid_of[d] for name in jobs[jid]['members']
+                             for d in self.graph.descendants(name) if d in jid_of])
+
+        running = {}  # task: job ID
+        try:
+            while True:
+                waiting = []
+                while tracker.ready and cpus > 0:
+                    item = heapq.heappop(tracker.ready)
+                    jid  = item[1]
+                    job  = jobs[jid]
+                    if job['status'] != 'pending':  # e.g. unsatisfiable
+                        continue
+                    if job['cpus-per-task'] > cpus or job['mem'] > mem:
+                        waiting.append(item)
+                        continue
+                    cpus -= job['cpus-per-task']
+                    mem  -= job['mem']
+                    job['status'] = 'running'
+                    running[asyncio.create_task(self._run_job(job))] = jid
+                    _notify([jid])
+                for item in waiting:
+                    heapq.heappush(tracker.ready, item)
+                if not running:
+                    # remaining ready processes do not fit and will never run
+                    for _, jid in tracker.ready:
+                        if jobs[jid]['status'] == 'pending':
+                            _fail(jid)
+                    tracker.ready.clear()
+                    break
+                finished, _ = await asyncio.wait(running,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    jid = running.pop(task)
+                    cpus += jobs[jid]['cpus-per-task']
+                    mem  += jobs[jid]['mem']
+                    if task.result() == 0:
+                        tracker.release(jid)
+                        _notify([jid])
+                        created = self.expand_scatters(jobs[jid]['members'])
+                    else:
+                        _fail(jid)
+                        created = []
+                    if created:
+                        self.create_directories()
+                        for name in created:
+                            self[name].format_executable()
+                        for new, job in self._jobs(created, max_mem is not None,
+                                                   max(jobs) + 1, jid_of).items():
+                            tracker.add(new, job)
+                            if job['status'] == 'unsatisfiable':
+                                _notify([new])
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.wait(running)
         self.generate_summary(verbose=False)
+        return dict((name, job['status']) for job in jobs.values()
+                    for name in job['members'])
+
+    async def _run_job(self, job: dict) -> int:
+        """
+        Runs the script of a process, or of processes connected by streams
+        (their output is written by their scripts in their working directory).
+
+        :returns: the return code of the script
+        """
+        members = job['members']
+        if len(members) == 1:
+            container = self[members[0]].singularity
+            script    = os.path.join(self[members[0]].workdir, '.command.sh')
+        else:  # each member is run in its own container by the script
+            container = ''
+            script    = self._write_gang_script(job['name'], members)
+        proc = await asyncio.create_subprocess_shell(
+            f'{container}/bin/bash {shlex.quote(script)}',
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            return await proc.wait()
+        except asyncio.CancelledError:
+            proc.terminate()  # the script writes its .error marker
+            await proc.wait()
+            raise
+
+    def expand_scatters(self, done) -> list:
+        """
+        Creates the processes of the pending fan-outs (see `scatter`) of
+        processes that are done.
+
+        :param done: names of processes that ended successfully
+
+        :returns: names of the processes created, in topological order
+        """
+        globals.processes = self
+        created = []
+        for fan_out in [s for s in self.scatters if s.process.name in done]:
+            self.scatters.remove(fan_out)
+            created.extend(fan_out.expand())
+        return created
+
+    def _copy_helpers(self) -> None:
+        """
+        Copies in the results directory the scripts used by the jobs (resource
+        sampler, runner of Python calls), if needed.
+        """
+        if self.profile:
+            os.makedirs(os.path.dirname(self.monitor_path), exist_ok=True)
+            shutil.copyfile(monitor_tasks.__file__, self.monitor_path)
+        if any(getattr(p, 'call', None) is not None for p in self.values()):
+            os.makedirs(os.path.dirname(self.call_runner_path), exist_ok=True)
+            shutil.copyfile(python_call.__file__, self.call_runner_path)
+
+    @property
+    def monitor_path(self) -> str:
+        """
+        Copy of the resource sampler used by jobs (in the results directory,
+        to be reachable from containers)
+        """
+        return os.path.join(self.result_dir, 'tmp', '_profiling', 'monitor_tasks.py')
+
+    @property
+    def call_runner_path(self) -> str:
+        """
+        Copy of the script running the processes backed by a Python function
+        (see `Python_call`)
+        """
+        return os.path.join(self.result_dir, 'tmp', '_python', 'python_call.py')
+
+    def makedirs(self, path: str) -> None:
+        """
+        Creates a directory (and its parents), or only records it with `lazy_fs`
+        """
+        if self.lazy_fs:
+            self._pending_dirs.add(path)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def create_directories(self) -> None:
+        """
+        Creates all directories recorded with `lazy_fs` (nothing with
+        `dry_run`). Only the deepest directories are created explicitly, their
+        parents being created on the way, optionally in several threads
+        (`fs_workers`).
+        """
+        if self.dry_run or not self._pending_dirs:
+            return
+        parents = set()
+        for path in self._pending_dirs:
+            parent = os.path.dirname(path)
+            while parent not in parents and parent != os.path.dirname(parent):
+                parents.add(parent)
+                parent = os.path.dirname(parent)
+        leaves = sorted(self._pending_dirs - parents)
+        if self.fs_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.fs_workers) as executor:
+                list(executor.map(functools.partial(os.makedirs, exist_ok=True), leaves))
+        else:
+            for path in leaves:
+                os.makedirs(path, exist_ok=True)
+        self._pending_dirs.clear()
+
+    def _pack_jobs(self, names: list, batch_size: int, batch_by: str,
+                   gangs: dict=None) -> list:
+        """
+        Groups processes (in topological order) into jobs of at most
+        `batch_size` processes. A process is never packed with one of its
+        dependencies, nor in a job created before the job of a dependency, so
+        the list of jobs is itself in topological order.
+
+        Processes connected by streams (see `gangs`) are a job of their own,
+        placed at the position of the last of them.
+
+        :param None gangs: as returned by `gangs` (computed if not given)
+
+        :returns: list of jobs, each job a list of process names
+        """
+        if gangs is None:
+            gangs = self.gangs()
+        in_names = set(names) if gangs else ()
+        jobs = []
+        job_of = {}
+        open_jobs = {}
+        for name in names:
+            if name in gangs:
+                members = [m for m in gangs[name] if m in in_names]
+                if name == members[-1]:
+                    jobs.append(members)
+                    for member in members:
+                        job_of[member] = len(jobs) - 1
+                continue
+            process = self[name]
+            if batch_size <= 1:
+                key = None
+            elif batch_by == 'family':
+                key = (process.func_name if name in self.families.get(process.func_name, {})
+                       else name, process.singularity)
+            else:
+                key = (process.cpus, process.memory, str(process.time), process.singularity)
+            idx = open_jobs.get(key)
+            if (key is None or idx is None or len(jobs[idx]) >= batch_size or
+                any(job_of.get(dep, -1) >= idx for dep in self.graph.parents[name])):
+                jobs.append([])
+                idx = len(jobs) - 1
+                open_jobs[key] = idx
+            jobs[idx].append(name)
+            job_of[name] = idx
+        return jobs
+
+    def gangs(self) -> dict:
+        """
+        Groups of processes connected by streams (see `IO_type`), to be run at
+        the same time.
+
+        :returns: dictionary with, for each process connected by a stream, the
+           list of the processes of its group (in topological order)
+        """
+        groups = {}
+        for name in self.graph.topological_order():
+            for producer in getattr(self[name], 'streams', {}).values():
+                if producer not in self:  # not loaded
+                    continue
+                group = groups.get(name, [name])
+                other = groups.get(producer, [producer])
+                if group is other:
+                    continue
+                group.extend(other)
+                for member in group:
+                    groups[member] = group
+        if not groups:
+            return {}
+        order = dict((name, num) for num, name in enumerate(self.graph.topological_order()))
+        gangs = {}
+        for group in groups.values():
+            if group[0] in gangs:
+                continue
+            members = sorted(group, key=order.get)
+            # a process outside the group can not depend on one member and be
+            # needed by another one (the group would wait for itself)
+            member_set = set(members)
+            for member in members:
+                for dep in self.graph.parents[member] - member_set:
+                    if self.graph.ancestors(dep) & member_set:
+                        raise ValueError(f'ERROR: {dep} depends on processes connected '
+                                         f'by streams to {member}, which depends on it')
+            for member in members:
+                gangs[member] = members
+        return gangs
+
+    def _one_to_one(self, members: list, other: list) -> bool:
+        """
+        Checks if the N-th process of `members` depends, within `other`, only
+        on the N-th process of `other`.
+        """
+        if len(members) != len(other) or len(other) == 1:
+            return False
+        other_set = set(other)
+        return all(self.graph.parents[name] & other_set == set([dep])
+                   for name, dep in zip(members, other))
+
+    def _write_array_script(self, name: str, members: list) -> tuple:
+        """
+        Writes the mapping between array task index and process script (TSV with
+        index, process name and path to script), and the script running the
+        process of a given index.
+
+        :returns: path to the script and path to the mapping file
+        """
+        array_dir = os.path.join(self.result_dir, 'tmp', '_arrays')
+        array_map = os.path.join(array_dir, f'{name}.tsv')
+        script = os.path.join(array_dir, f'{name}.sh')
+        if self.dry_run:
+            return script, array_map
+        os.makedirs(array_dir, exist_ok=True)
+        with open(array_map, 'w', encoding='utf-8') as out:
+            for idx, member in enumerate(members, 1):
+                out.write(f"{idx}\t{member}\t"
+                          f"{os.path.join(self[member].workdir, '.command.sh')}\n")
+        with open(script, 'w', encoding='utf-8') as out:
+            out.write(ARRAY_SCRIPT.format(MAP=array_map))
+        return script, array_map
+
+    def _write_batch_script(self, name: str, members: list, parallel: int) -> str:
+        """
+        Writes the script of a meta-process running the scripts of several
+        processes, `parallel` at a time. It fails if any of them fails.
+
+        :returns: path to the script
+        """
+        batch_dir = os.path.join(self.result_dir, 'tmp', '_batches')
+        script = os.path.join(batch_dir, f'{name}.sh')
+        if self.dry_run:
+            return script
+        os.makedirs(batch_dir, exist_ok=True)
+        scripts = ' \\\n    '.join(os.path.join(self[m].workdir, '.command.sh')
+                                  for m in members)
+        with open(script, 'w', encoding='utf-8') as out:
+            out.write(BATCH_SCRIPT.format(NPROCS=len(members), PARALLEL=parallel,
+                                          SCRIPTS=scripts))
+        return script
+
+    def _write_gang_script(self, name: str, members: list) -> str:
+        """
+        Writes the script of a job running at the same time processes
+        connected by streams (each one with its own singularity image, if any),
+        creating their named pipes first.
+
+        :returns: path to the script
+        """
+        gang_dir = os.path.join(self.result_dir, 'tmp', '_gangs')
+        script = os.path.join(gang_dir, f'{name}.sh')
+        if self.dry_run:
+            return script
+        os.makedirs(gang_dir, exist_ok=True)
+        fifos = [path for m in members for path in getattr(self[m], 'streams', {})]
+        with open(script, 'w', encoding='utf-8') as out:
+            out.write(GANG_SCRIPT.format(
+                NPROCS=len(members),
+                FIFOS=' '.join(shlex.quote(f) for f in fifos),
+                WORKDIRS=' '.join(shlex.quote(self[m].workdir) for m in members),
+                CONTAINERS=' '.join(shlex.quote(self[m].singularity.strip())
+                                    for m in members)))
+        return script
+
+    def find_processes_to_run(self, snapshot: Status_snapshot=None) -> set:
+        """
+        Processes that are not done, or stale (see `Process.is_stale`), and
+        all their descendants (and the processes connected to them by streams).
+
+        :param None snapshot: Status_snapshot to use to check processes status.
+
+        :returns: set of process names
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        to_run = set()
+        for name in self.graph.topological_order():
+            process = self[name]
+            if (any(d in to_run for d in self.graph.parents[name]) or
+                not process.is_done(snapshot) or process.is_stale(snapshot)):
+                to_run.add(name)
+        # processes connected by streams are run together (and then their
+        # descendants)
+        gangs = self.gangs()
+        added = bool(gangs)
+        while added:
+            added = False
+            for name in self.graph.topological_order():
+                if name in to_run:
+                    continue
+                if (any(d in to_run for d in self.graph.parents[name]) or
+                    any(m in to_run for m in gangs.get(name, ()))):
+                    to_run.add(name)
+                    added = True
+        return to_run
+
+    def _analysis_order(self, names=None) -> list:
+        names = set(self) if names is None else set(names)
+        return [n for n in self.graph.topological_order() if n in names]
+
+    def start_times(self, names=None) -> tuple:
+        """
+        Earliest and latest start of each process, with unlimited resources and
+        processes lasting their requested `time`. A process starting later than
+        its latest start delays the whole workflow.
+
+        :param None names: only consider these processes (e.g. the ones still
+           to be run), by default all.
+
+        :returns: two dictionaries with the earliest and the latest start (in
+           seconds) of each process
+        """
+        order = self._analysis_order(names)
+        durations = dict((n, time_to_seconds(self[n].time)) for n in order)
+        earliest = {}
+        for name in order:
+            earliest[name] = max((earliest[d] + durations[d]
+                                  for d in self.graph.parents[name] if d in earliest),
+                                 default=0)
+        end = max((earliest[n] + durations[n] for n in order), default=0)
+        latest = {}
+        for name in reversed(order):
+            latest[name] = min((latest[c] for c in self.graph.children[name]
+                                if c in latest), default=end) - durations[name]
+        return earliest, latest
+
+    def critical_path(self, names=None) -> list:
+        """
+        Longest chain of dependent processes (from their requested `time`).
+
+        :param None names: only consider these processes, by default all.
+
+        :returns: list of process names, in order of execution
+        """
+        earliest, latest = self.start_times(names)
+        if not earliest:
+            return []
+        durations = dict((n, time_to_seconds(self[n].time)) for n in earliest)
+        name = max(earliest, key=lambda n: earliest[n] + durations[n])
+        path = [name]
+        while earliest[name] > 0:
+            # a parent finishing exactly when the process can start
+            name = next(d for d in self.graph.parents[name] if d in earliest and
+                        earliest[d] + durations[d] == earliest[name])
+            path.append(name)
+        return path[::-1]
+
+    def cpu_hours(self, names=None) -> float:
+        """
+        :param None names: only consider these processes, by default all.
+
+        :returns: total CPU time requested (CPUs times `time`) in hours
+        """
+        return sum(self[n].cpus * time_to_seconds(self[n].time)
+                   for n in self._analysis_order(names)) / 3600
+
+    def _jobs(self, order: list, memory: bool=True, first: int=1,
+              jid_of: dict=None) -> dict:
+        """
+        Jobs running the processes, in the format of `sf.scheduler.parse_jobs`:
+        one job per process, or per group of processes connected by streams
+        (see `gangs`).
+
+        :param order: names of the processes, in topological order (job IDs
+           follow it)
+        :param True memory: if False the memory of the jobs is set to 0
+        :param 1 first: ID of the first job
+        :param None jid_of: job ID of processes already in jobs, that the new
+           ones may depend on (updated with the new jobs)
+
+        :returns: dictionary of jobs indexed by job ID (with the names of
+           their processes as 'members')
+        """
+        groups = self._pack_jobs(order, 1, 'family')
+        if jid_of is None:
+            jid_of = {}
+        jid_of.update((name, jid) for jid, members in enumerate(groups, first)
+                      for name in members)
+        jobs = {}
+        for jid, members in enumerate(groups, first):
+            depe = set(jid_of[d] for name in members
+                       for d in self.graph.parents[name] if d in jid_of) - set([jid])
+            jobs[jid] = {
+                'name'         : (members[0] if len(members) == 1 else
+                                  f'{self[members[0]].func_name}_gang{jid}'),
+                'members'      : members,
+                'cpus-per-task': sum(self[n].cpus for n in members),
+                'mem'          : sum(self[n].memory for n in members) if memory else 0,
+                'time'         : seconds_to_time(max(time_to_seconds(self[n].time)
+                                                     for n in members)),
+                'depe'         : depe,
+                'status'       : 'dependent' if depe else 'pending',
+                }
+        return jobs
+
+    def estimate_makespan(self, cpus: int, memory: float=None, names=None) -> int:
+        """
+        Estimates the time needed to run the processes with a given number of
+        CPUs (and memory), simulating the 'critical-path' policy of
+        `sf.scheduler.Scheduler` with each process lasting its requested `time`.
+
+        :param cpus: number of CPUs available
+        :param None memory: memory available in Gb (unlimited by default)
+        :param None names: only consider these processes, by default all.
+
+        :returns: estimated makespan in seconds
+        """
+        jobs = self._jobs(self._analysis_order(names), memory is not None)
+        simulator = Simulator(jobs, cpus, float('inf') if memory is None else memory,
+                              policy='critical-path')
+        simulator.run()
+        failed = [name for job in jobs.values() if job['status'] != 'done'
+                  for name in job['members']]
+        if failed:
+            raise ValueError(f"ERROR: processes requesting more than {cpus} CPUs "
+                             f"or {memory} Gb can not be run: {', '.join(failed)}")
+        return simulator.clock
+
+    def estimate(self, cpus: int=None, memory: float=None, names=None) -> dict:
+        """
+        Summary of the resources needed to run the processes.
 
+        :param None cpus: number of CPUs available, to estimate the makespan
+        :param None memory: memory available in Gb (unlimited by default)
+        :param None names: only consider these processes, by default all.
+
+        :returns: dictionary with the number of processes, the total CPU hours,
+           the critical path (list of processes) and its length in seconds, the
+           earliest and latest start of each process, and the estimated
+           makespan in seconds with `cpus` CPUs (None if not given)
+        """
+        earliest, latest = self.start_times(names)
+        path = self.critical_path(names)
+        return {
+            'processes'           : len(earliest),
+            'cpu_hours'           : self.cpu_hours(names),
+            'critical_path'       : path,
+            'critical_path_length': max((latest[n] + time_to_seconds(self[n].time)
+                                         for n in latest), default=0),
+            'earliest_start'      : earliest,
+            'latest_start'        : latest,
+            'makespan'            : (None if cpus is None else
+                                     self.estimate_makespan(cpus, memory, names)),
+            }
+
+    def save(self, statuses: dict=None) -> None:
+        """
+        Save the state of the run in the results directory (see `run_store`).
+
+        :param None statuses: dictionary of status per process name, recorded
+           in the status history of the SQLite store.
+        """
+        if getattr(self, 'run_store', 'pickle') == 'sqlite':
+            with FileLock(store_path(self.result_dir)):
+                with Run_store(store_path(self.result_dir)) as store:
+                    store.save(self, statuses)
+        else:
+            self.to_pickle()
+
+    @staticmethod
+    def load(result_dir: str, **filters) -> 'Process_dict':
+        """
+        Loads the processes saved in a results directory, from the SQLite store
+        if any, otherwise from the pickle.
+
+        :param result_dir: results directory of the run
+        :param filters: `rule`, `family` or `status` to load only a subset of
+           the processes (only with the SQLite store)
+        """
+        if os.path.exists(store_path(result_dir)):
+            with Run_store(store_path(result_dir)) as store:
+                processes = store.load(**filters)
+            processes.run_store = 'sqlite'
+            return processes
+        if any(v is not None for v in filters.values()):
+            raise ValueError('ERROR: partial loading needs a SQLite run store '
+                             "(use run_store='sqlite' in Process_dict)")
+        with open(os.path.join(result_dir, '_processes.pkl'), 'rb') as fh:
+            return load(fh)
 
     def to_pickle(self) -> None:
         """
@@ -226,7 +1166,40 @@ class Process_dict(dict):
                 dump(self, out)
 
 
-    def generate_summary(self, hide_files: bool=False, verbose: bool=False) -> None:
+    def collect_metadata(self, snapshot: Status_snapshot=None,
+                         workers: int=1) -> dict:
+        """
+        Gathers the metadata (including status) of all processes.
+
+        :param None snapshot: Status_snapshot to use to check processes status.
+           By default a new one is created.
+        :param 1 workers: number of threads used to probe processes in parallel
+           (useful on networked filesystems with high latency).
+
+        :returns: a dictionary of metadata per process name
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        if workers <= 1:
+            metadata = dict((name, p.get_metadata(snapshot)) for name, p in self.items())
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                metadata = dict(zip(self.keys(),
+                                    executor.map(lambda p: p.get_metadata(snapshot),
+                                                 self.values())))
+        # processes depending on something that will be re-run are stale
+        for name in self.graph.topological_order():
+            if metadata[name]['status'] != 'Done':
+                continue
+            if any(metadata[d]['status'] != 'Done' for d in self.graph.parents[name]
+                   if d in metadata):
+                metadata[name]['status'] = 'Stale'
+                metadata[name]['class']  = 'stale'
+        return metadata
+
+    def generate_summary(self, hide_files: bool=False, verbose: bool=False,
+                         snapshot: Status_snapshot=None, workers: int=1,
+                         process_metadata: dict=None) -> None:
         """
         generates a summary files including:
          - a mermaid Directed Acyclic Graph from the processes dictionary
@@ -235,48 +1208,49 @@ class Process_dict(dict):
         
         :param False hide_files: intermediate and output files are ommitted, only
            shows original input files and processes. TODO: not implemented
+        :param None snapshot: Status_snapshot to use to check processes status.
+           By default a new one is created for this summary.
+        :param 1 workers: number of threads used to probe processes status
+        :param None process_metadata: metadata per process, as returned by
+           `collect_metadata` (with `snapshot`). By default it is collected here.
         """
-        # define all subgraphs(modules grouping processes)
-        node_groups = set(p.module.lower() for p in self.values())
-        tsv = open(os.path.join(self.result_dir, 'run_summary.tsv'), 'w', encoding='utf-8')
-        tsv.write(f"# Group\tRule\tprocess\tStatus\t"
-                    f"time spent\tinputs\toutputs\n")
-        chart = """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        if process_metadata is None:
+            process_metadata = self.collect_metadata(snapshot, workers=workers)
+        # group processes by module (subgraph) and rule, in a single pass
+        groups = defaultdict(lambda: defaultdict(list))
+        for p in self.values():
+            groups[p.module.lower()][p.rule_name].append(p)
+
+        tsv = ["# Group\tRule\tprocess\tStatus\t"
+               "time spent\tinputs\toutputs\t"
+               "peak CPU\taverage CPU\tpeak memory\taverage memory\n"]
+        chart = ["""
 ---
 title: nanoCT-3D
 ---
 graph TD
-"""
-        
+"""]
         name2rule = {}
         metadata = {}
-        nodes = set()
         # add subnodes to groups
-        for group in node_groups:
+        for group, rules in groups.items():
             if verbose:
                 sys.stderr.write(f"- {group}\n")
-            chart += f"    subgraph {group}\n"
-            rule_names = defaultdict(int)
-            for p in self.values():
-                if p.module.lower() != group:
-                    continue
-                rule_names[p.rule_name] += 1
-            for rule in rule_names:
+            chart.append(f"    subgraph {group}\n")
+            for rule, rule_processes in rules.items():
                 if verbose:
-                    sys.stderr.write(f"    - {p.rule_name}\n")
-                for p in self.values():
-                    if p.module.lower() != group:
-                        continue
-                    if p.rule_name != rule:
-                        continue
+                    sys.stderr.write(f"    - {rule}\n")
+                for p in rule_processes:
                     name2rule[p.name] = p.rule_name
-                    mdata = p.get_metadata()
+                    mdata = process_metadata[p.name]
                     if verbose:
                         sys.stderr.write(f"        - {p.name:<55}      "
                                          f"{color_status(mdata['status'], l_align=18)}\n")
                         if mdata['status'].lower() == 'error':
                             cmd_err = os.path.join(mdata['workdir'], '.command.err')
-                            if os.path.exists(cmd_err):
+                            if snapshot.exists(cmd_err):
                                 sys.stderr.write(f'\033[93m====> From {cmd_err}:\n')
                                 sys.stderr.write('-' * 80 + '\n')
                                 sys.stderr.write('\n'.join(tail(cmd_err, n=5)) + '\n')
@@ -286,35 +1260,201 @@ graph TD
                                 
                     inputs = ';'.join(f"{k}:{v}" for k, v in p.input.items())
                     outputs = ';'.join(f"{k}:{v}" for k, v in p.output.items())
-                    tsv.write(f"{group}\t{rule}\t{p.name}\t{mdata['status']}\t"
-                              f"{mdata['time_spent']}\t{inputs}\t{outputs}\n")
-                    if p.rule_name in nodes:
-                        continue
-                    nodes.add(p.rule_name)
-                    metadata[p.rule_name] = p.get_metadata()
-                    chart += f"        {p.rule_name}:::{metadata[p.rule_name]['class']}\n"
-            chart += "    end\n"
-        tsv.close()
+                    tsv.append(f"{group}\t{rule}\t{p.name}\t{mdata['status']}\t"
+                               f"{mdata['time_spent']}\t{inputs}\t{outputs}\t"
+                               f"{mdata['peak_cpu']}\t{mdata['average_cpu']}\t"
+                               f"{mdata['peak_mem']}\t{mdata['average_mem']}\n")
+                # the first process of the rule defines the class of the node
+                metadata[rule] = process_metadata[rule_processes[0].name]
+                chart.append(f"        {rule}:::{metadata[rule]['class']}\n")
+            chart.append("    end\n")
         # add edges
-        chart += "\n"
+        chart.append("\n")
         edge_names = set()
-        for p in self.values():
-            for d in p.dependencies:
-                a, b = name2rule[d], p.rule_name
+        for name in self.graph.topological_order():
+            b = name2rule[name]
+            for d in self.graph.parents[name]:
+                a = name2rule[d]
                 if (a, b) in edge_names:
                     continue
                 edge_names.add((a, b))
-                chart += f"{a} ---> {b}\n"
-        
-        chart = str(chart)
+                chart.append(f"{a} ---> {b}\n")
 
-        out = open(os.path.join(self.result_dir, 'DAG.mmd'), 'w', encoding='utf-8')
-        out.write(chart)
-        out.close()
+        tsv = ''.join(tsv)
+        chart = ''.join(chart)
 
-        generate_mermaid_html(chart, metadata_dict=metadata,
-                              output_file=os.path.join(self.result_dir, 'iDAG.html'))
-        self.to_pickle()
+        # only rewrite artifacts whose content changed since last summary
+        digests = _Summary_digests(self.result_dir)
+        tsv_path = os.path.join(self.result_dir, 'run_summary.tsv')
+        if digests.changed(tsv_path, tsv):
+            with open(tsv_path, 'w', encoding='utf-8') as out:
+                out.write(tsv)
+        chart_path = os.path.join(self.result_dir, 'DAG.mmd')
+        if digests.changed(chart_path, chart):
+            with open(chart_path, 'w', encoding='utf-8') as out:
+                out.write(chart)
+        html_path = os.path.join(self.result_dir, 'iDAG.html')
+        if digests.changed(html_path, chart, repr(metadata)):
+            generate_mermaid_html(chart, metadata_dict=metadata, output_file=html_path)
+        statuses = dict((name, mdata['status'])
+                        for name, mdata in process_metadata.items())
+        if not self.dry_run:
+            # only processes that finished since the previous summary (with a
+            # margin for the clock of shared filesystems)
+            since = digests.previous.get('_history')
+            if self.record_history(process_metadata, snapshot, since) or since is None:
+                since = snapshot.created - 60 * 10 ** 9
+            digests.current['_history'] = since
+        if digests.changed(self._state_path(), self._plan_signature(), repr(statuses)):
+            self.save(statuses)
+        digests.write()
+
+    def input_bucket(self, name: str, snapshot: Status_snapshot=None) -> int:
+        """
+        Input-size bucket of a process (see `size_bucket`): total size of its
+        primary input files or, if it has none, of the ones of the processes
+        it depends on.
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        def _size(names):
+            total = 0
+            for other in names:
+                for value in self[other].input.values():
+                    if value.type == 'path' and value.process is None:
+                        stat = snapshot.stat(str(value))
+                        total += 0 if stat is None else stat.st_size
+            return total
+        size = _size([name])
+        if not size:
+            size = _size(a for a in self.graph.ancestors(name) if a in self)
+        return size_bucket(size)
+
+    def apply_history(self, process: 'Process') -> None:
+        """
+        Sets the resources learnt from the history for a process (see
+        `resources`). The declared ones are kept in `Process.declared`.
+        """
+        if getattr(self, 'resources', 'declared') == 'declared':
+            return
+        if self._suggestions is None:
+            self._suggestions = {}
+            if os.path.exists(self.history):
+                with Run_history(self.history) as history:
+                    self._suggestions = history.suggestions()
+        suggestion = self._suggestions.get((process.rule_key,
+                                            self.input_bucket(process.name)))
+        process.suggested = suggestion
+        if self.resources != 'auto' or suggestion is None:
+            return
+        process.time = seconds_to_time(suggestion['time'])
+        if suggestion['cpus'] is not None:
+            process.cpus = suggestion['cpus']
+        if suggestion['memory'] is not None:
+            process.memory = suggestion['memory']
+
+    def suggest_resources(self) -> dict:
+        """
+        :returns: dictionary, per process name, of the declared resources and
+           the ones learnt from the history (None if not enough observations)
+        """
+        suggestions = {}
+        if os.path.exists(self.history):
+            with Run_history(self.history) as history:
+                suggestions = history.suggestions()
+        snapshot = Status_snapshot()
+        return dict((name, {'declared' : getattr(p, 'declared', None),
+                            'suggested': suggestions.get((p.rule_key,
+                                                          self.input_bucket(name, snapshot)))})
+                    for name, p in self.items())
+
+    def record_history(self, process_metadata: dict,
+                       snapshot: Status_snapshot=None, since: int=None) -> int:
+        """
+        Records in the history the resources used by finished processes (each
+        run of a process is recorded once).
+
+        :param process_metadata: metadata per process, as returned by
+           `collect_metadata`
+        :param None snapshot: Status_snapshot to use to check processes
+        :param None since: only consider processes that finished after this
+           time (in nanoseconds), by default all
+
+        :returns: number of processes considered
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        observations = []
+        considered = 0
+        for name, mdata in process_metadata.items():
+            if mdata['status'] not in ('Done', 'Stale'):
+                continue
+            process = self[name]
+            if (since is not None and
+                snapshot.mtime(os.path.join(process.workdir, '.done')) < since):
+                continue
+            considered += 1
+            usage = process.get_usage(snapshot)
+            if usage is None:
+                continue
+            usage.update({'rule'   : process.rule_key,
+                          'bucket' : self.input_bucket(name, snapshot),
+                          'process': name,
+                          'cpus'   : process.cpus})
+            observations.append(usage)
+        if observations:
+            with Run_history(self.history) as history:
+                history.record(observations)
+        return considered
+
+    def _state_path(self) -> str:
+        if getattr(self, 'run_store', 'pickle') == 'sqlite':
+            return store_path(self.result_dir)
+        return os.path.join(self.result_dir, '_processes.pkl')
+
+    def _plan_signature(self) -> str:
+        """
+        String describing the processes and their dependencies (not their status)
+        """
+        return repr([(name, p.command, p.workdir, p.cpus, p.memory, p.time,
+                      sorted(self.graph.parents[name]), sorted(dict.items(p.output)))
+                     for name, p in self.items()])
+
+
+class _Summary_digests:
+    """
+    Digests of the summary artifacts written in a results directory, used to
+    skip rewriting those that did not change.
+    """
+    def __init__(self, result_dir: str):
+        self.path = os.path.join(result_dir, '_summary_digest.json')
+        try:
+            with open(self.path, encoding='utf-8') as fh:
+                self.previous = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            self.previous = {}
+        self.current = {}
+
+    def changed(self, path: str, *contents) -> bool:
+        """
+        :param path: path to the artifact
+        :param contents: strings from which the artifact is generated
+
+        :returns: True if the artifact is missing or its contents changed
+        """
+        artifact = os.path.basename(path)
+        digest = hashlib.md5()
+        for content in contents:
+            digest.update(content.encode('utf-8'))
+        self.current[artifact] = digest.hexdigest()
+        return (self.previous.get(artifact) != self.current[artifact] or
+                not os.path.exists(path))
+
+    def write(self) -> None:
+        if self.current == self.previous:
+            return
+        with open(self.path, 'w', encoding='utf-8') as out:
+            json.dump(self.current, out, indent=1)
 
 
 class _Process_output(dict):
@@ -334,6 +1474,17 @@ class _Process_output(dict):
                     return sister.output[key]
         raise KeyError(f'key "{key}" not found')
 
+    def owner(self, key):
+        """
+        :returns: process (itself or a sister process) declaring the output `key`
+        """
+        if dict.__contains__(self, key):
+            return self.process
+        for sister in self.process.processes.families[self.process.func_name].values():
+            if dict.__contains__(sister.output, key):
+                return sister
+        raise KeyError(f'key "{key}" not found')
+
 
 class Process:
     """
@@ -360,7 +1511,7 @@ class Process:
         self.processes = processes
         self.module, self.rule_name = module[-2:]
         self.workdir      = workdir
-        os.system(f'mkdir -p {workdir}')
+        processes.makedirs(workdir)
         self.input        = input_
         self.func_name    = func_name
         # output paths that are not absolute are placed inside workdir
@@ -368,7 +1519,17 @@ class Process:
             if not os.path.isabs(v):
                 output[k] = os.path.join(self.workdir, v)
         self.output       = _Process_output(self, output)
+        # files matching outputs declared as patterns (set when checked)
+        self.resolved_outputs = {}
 
+        # rules running a Python function: the command runs the call stored
+        # in the working directory
+        if isinstance(command, Python_call):
+            self.call = command
+            command   = (f"{shlex.quote(sys.executable)} {shlex.quote(processes.call_runner_path)} "
+                         f"{shlex.quote(os.path.join(workdir, '.call.pkl'))}")
+        else:
+            self.call = None
         # commands including path to executable inside the bin folder are made absolute
         self.command      = command.replace(' bin/', f' {globals.processes.result_dir}/bin/')
         if self.command.startswith('bin/'):
@@ -377,9 +1538,15 @@ class Process:
         self.name         = name
         # define dependencies. Extra care for sister processes in the family
         self.dependencies = set()
+        # named pipes read by the process: process writing them
+        self.streams      = {}
         for v1 in self.input.values():
             if v1.process is None:
                 continue
+            if v1.type == 'stream':
+                self.streams[v1.value] = v1.process.name
+                self.dependencies.add(v1.process.name)
+                continue
             try:
                 for v in processes.families[v1.process.func_name]:
                     self.dependencies.add(v)
@@ -389,6 +1556,10 @@ class Process:
         self.cpus         = cpus
         self.memory       = memory   # Gb
         self.time         = time     # hours
+        # resources requested in the rule call (cpus, memory and time may be
+        # replaced by the ones learnt from previous runs)
+        self.declared     = {'cpus': cpus, 'memory': memory, 'time': time}
+        self.suggested    = None
 
         self.status       = False
 
@@ -399,6 +1570,9 @@ class Process:
         self.env         = '' if env         is None else env
         self.singularity = '' if singularity is None else singularity
 
+        # extra parameters of the rule call (part of the process signature)
+        self.params      = kwargs
+
         # gets an error if something missing:
         self.check_input()
         # checks that all outputs are there
@@ -413,37 +1587,151 @@ class Process:
             for origin_file, *destiny in publish:
                 dest_name = os.path.join(*destiny)  # dirty trick for renaming possibility
                 dest_name = os.path.join(globals.processes.result_dir, dest_name)
-                os.system(f'mkdir -p {dest_name}')
+                self.processes.makedirs(dest_name)
                 self.publish.append(f"cp -rf {origin_file} {dest_name}")
 
+    def signature(self, snapshot: Status_snapshot=None) -> dict:
+        """
+        Describes everything that, if changed, requires the process to be
+        re-run: command, environment, parameters and primary input files (their
+        size and modification time, or their content hash if
+        `Process_dict.hash_inputs`). Inputs generated by other processes are
+        covered by the staleness of those processes.
+
+        :param None snapshot: Status_snapshot to use to check input files
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        inputs = {}
+        for key, value in self.input.items():
+            inputs[key] = f'{value.type}:{value}'
+            if value.type != 'path' or value.process is not None:
+                continue
+            stat = snapshot.stat(str(value))
+            if stat is None:
+                continue
+            if getattr(self.processes, 'hash_inputs', False) and snapshot.digest(str(value)):
+                inputs[key] += f':{snapshot.digest(str(value))}'
+            else:
+                inputs[key] += f':{stat.st_size}:{stat.st_mtime_ns}'
+        command = self.command
+        if getattr(self, 'call', None) is not None:
+            command += f'\n{self.call!r}'
+        return {
+            'command'    : hashlib.sha256(command.encode('utf-8')).hexdigest(),
+            'env'        : self.env,
+            'singularity': self.singularity,
+            'publish'    : self.publish,
+            'params'     : repr(sorted(getattr(self, 'params', {}).items())),
+            'inputs'     : inputs,
+            }
+
+    def is_stale(self, snapshot: Status_snapshot=None) -> bool:
+        """
+        Checks if a process that has been run is out of date: its signature
+        changed since it was run, or one of its dependencies finished after it.
+        Processes run without recorded signature are never stale.
+
+        :param None snapshot: Status_snapshot to use to check files
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        done = snapshot.mtime(os.path.join(self.workdir, '.done'))
+        # processes writing streams end at the same time as the process
+        streams = set(getattr(self, 'streams', {}).values())
+        for dep in self.dependencies - streams:
+            try:
+                dep_workdir = self.processes[dep].workdir
+            except KeyError:
+                continue
+            if snapshot.mtime(os.path.join(dep_workdir, '.done')) > done:
+                return True
+        recorded = snapshot.read(os.path.join(self.workdir, '.signature'))
+        if recorded is None:
+            return False
+        try:
+            return json.loads(recorded) != self.signature(snapshot)
+        except ValueError:
+            return True
+
+    def adopt_signature(self, snapshot: Status_snapshot=None) -> None:
+        """
+        Records the current signature of a process done without one (e.g. run
+        with an older version of SnapFlow)
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        if snapshot.exists(os.path.join(self.workdir, '.signature')):
+            return
+        if not snapshot.exists(os.path.join(self.workdir, '.done')):
+            return
+        self._write_signature('.signature', snapshot)
+
+    def _write_signature(self, file_name: str, snapshot: Status_snapshot=None) -> None:
+        with open(os.path.join(self.workdir, file_name), 'w', encoding='utf-8') as out:
+            json.dump(self.signature(snapshot), out, indent=1)
+
     def format_executable(self):
+        # recorded as the signature of the process once it succeeds
+        self._write_signature('.signature.next')
+        interval = getattr(self.processes, 'profile', 0)
+        if interval:
+            profile = PROFILE_START.format(MONITOR=self.processes.monitor_path,
+                                           INTERVAL=interval, WORKDIR=self.workdir)
+            profile_end = PROFILE_END.format(WORKDIR=self.workdir)
+        else:
+            profile = profile_end = ''
+        if getattr(self, 'call', None) is not None:
+            with open(os.path.join(self.workdir, '.call.pkl'), 'wb') as out:
+                dump({'module'    : self.call.module,
+                      'root'      : self.call.root,
+                      'name'      : self.call.name,
+                      'args'      : self.call.args,
+                      'kwargs'    : self.call.kwargs,
+                      # can be run by a persistent Python worker
+                      'in_process': not (self.env or self.singularity or interval),
+                      'publish'   : ' && '.join(self.publish)}, out)
         script = PROCESS_SCRIPT.format(
             WORKDIR=self.workdir,
             ENV=self.env,
+            PROFILE=profile,
+            PROFILE_END=profile_end,
             CMD=self.command,
             PUBLISH=' && '.join(self.publish) if self.publish else f'echo {self.name}')
         out = open(os.path.join(self.workdir, '.command.sh'), 'w', encoding='utf-8')
         out.write(script)
         out.close()
         
-    def get_metadata(self):
+    def get_metadata(self, snapshot: Status_snapshot=None):
+        """
+        :param None snapshot: Status_snapshot to use to check the status of the
+           process. By default a new one is created.
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
         def _get_time(path) -> str:
-            tpath = os.path.join(path, '.done')
-            if os.path.exists(tpath):
-                try:
-                    seconds = int(next(open(tpath, encoding='utf-8')).strip())
-                except ValueError:  # for back compatibility TODO: remove in future
-                    return 'N/A'
-                return str(timedelta(seconds=seconds))
-            tpath = os.path.join(path, '.error')
-            if os.path.exists(tpath):
-                seconds = int(next(open(tpath, encoding='utf-8')).strip())
-                return str(timedelta(seconds=seconds))
-            return 'N/A'
-        status = ('Done' if self.is_done() else
-                  'Missing output' if os.path.exists(os.path.join(self.workdir, '.done')) else
-                  'Error' if os.path.exists(os.path.join(self.workdir, '.error')) else
-                  'Running' if os.path.exists(os.path.join(self.workdir, '.running')) else
+            seconds = snapshot.read_first_line(os.path.join(path, '.done'))
+            if seconds is None:
+                seconds = snapshot.read_first_line(os.path.join(path, '.error'))
+            if seconds is None:
+                return 'N/A'
+            try:
+                return str(timedelta(seconds=int(seconds)))
+            except ValueError:  # for back compatibility TODO: remove in future
+                return 'N/A'
+        def _get_profile(key, unit) -> str:
+            if profile is None or key not in profile:
+                return 'N/A'
+            if unit == '%':
+                return f"{profile[key]}%"
+            return f"{profile[key] / 1024 ** 2:.2f} Gb"
+        profile = self.get_profile(snapshot)
+        if profile is None:  # not profiled, or sampler stopped too early
+            profile = self._usage_profile(snapshot)
+        status = (('Stale' if self.is_stale(snapshot) else 'Done') if self.is_done(snapshot) else
+                  'Missing output' if snapshot.exists(os.path.join(self.workdir, '.done')) else
+                  'Error' if snapshot.exists(os.path.join(self.workdir, '.error')) else
+                  'Running' if snapshot.exists(os.path.join(self.workdir, '.running')) else
                   'Pending')
         return {
             'label'     : self.name,
@@ -453,16 +1741,104 @@ class Process:
             'status'    : status,
             'inputs'    : '<ul>' + '\n'.join(f'<li>{k}: <i>{str(v).split("/")[-1]}</i></li>' 
                                              for k, v in self.input.items()) + '</ul>',
-            'outputs'   : '<ul>' + '\n'.join(f'<li>{k}: <i>{str(v).split("/")[-1]}</i></li>'
+            'outputs'   : '<ul>' + '\n'.join(f'<li>{k}: <i>{str(v).split("/")[-1]}</i>'
+                                             f'{self._count_files(k, v)}</li>'
                                              for k, v in self.output.items()) + '</ul>',
+            'peak_cpu'   : _get_profile('peak_cpu', '%'),
+            'average_cpu': _get_profile('average_cpu', '%'),
+            'peak_mem'   : _get_profile('peak_rss_kb', 'Gb'),
+            'average_mem': _get_profile('average_rss_kb', 'Gb'),
             }
 
-    def is_done(self):
+    def _usage_profile(self, snapshot: Status_snapshot):
+        """
+        :returns: average CPU used by the last successful run of the process
+           (from its CPU time, see `get_usage`), in the format of
+           `get_profile`. None if not known.
+        """
+        usage = self.get_usage(snapshot)
+        if usage is None or usage['cpu_time'] is None:
+            return None
+        # runtime is counted in whole seconds
+        return {'average_cpu': round(usage['cpu_time'] / max(1, usage['runtime']) * 100, 1)}
+
+    @property
+    def rule_key(self) -> str:
+        """
+        Name of the rule in the history of resources used
+        """
+        return f"{self.module}.{self.func_name}"
+
+    def get_usage(self, snapshot: Status_snapshot=None):
+        """
+        Resources used by the last successful run of the process.
+
+        :param None snapshot: Status_snapshot to use to check files
+
+        :returns: dictionary with the time it finished (modification time of
+           `.done` in ns), the runtime and CPU time (user + system of all its
+           commands) in seconds and its peak memory in Gb (None when not
+           measured). None if the process is not done.
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        done = os.path.join(self.workdir, '.done')
+        try:
+            runtime = int(snapshot.read_first_line(done))
+        except (TypeError, ValueError):
+            return None
+        usage = {'finished': snapshot.mtime(done), 'runtime': runtime,
+                 'cpu_time': None, 'peak_mem': None}
+        profile = self.get_profile(snapshot)
+        if profile is not None:
+            usage['peak_mem'] = profile['peak_rss_kb'] / 1024 ** 2
+        content = snapshot.read(os.path.join(self.workdir, '.usage'))
+        if content is None:
+            return usage
+        lines = content.splitlines()
+        # output of bash's `times`: the second line is for child processes
+        # ("0m1.230s 0m0.050s", user and system time)
+        if len(lines) > 1:
+            try:
+                usage['cpu_time'] = sum(int(m) * 60 + float(sec) for m, sec in
+                                        (t.rstrip('s').split('m') for t in lines[1].split()))
+            except ValueError:
+                pass
+        return usage
+
+    def get_profile(self, snapshot: Status_snapshot=None):
+        """
+        :param None snapshot: Status_snapshot to use to check files
+
+        :returns: CPU and memory profile of the last run of the process (see
+           `sf.IO_utils.monitor_tasks`), None if it was not profiled
+        """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        content = snapshot.read(os.path.join(self.workdir, '.profile'))
+        if content is None:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return None
+
+    def _count_files(self, key, path) -> str:
+        if not is_pattern(path):
+            return ''
+        return f" ({len(getattr(self, 'resolved_outputs', {}).get(key, []))} files)"
+
+    def is_done(self, snapshot: Status_snapshot=None):
         """
         Checks if a given process has laready been run
+
+        :param None snapshot: Status_snapshot to use to check files. By default
+           a new one is created.
         """
-        if (os.path.exists(os.path.join(self.workdir, '.done')) and
-            self.check_output()):
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        if (snapshot.exists(os.path.join(self.workdir, '.done')) and
+            self.check_output(snapshot)):
             self.status = "done"
             return True
         #print(self.func_name, self.workdir, os.path.exists(os.path.join(self.workdir, '.done')), self.check_output())
@@ -483,14 +1859,45 @@ class Process:
             errors = '\n - '.join(errors) + '\n'
             raise FileNotFoundError(f"Missing inputs: {errors}")
 
-    def check_output(self):
+    def check_output(self, snapshot: Status_snapshot=None):
         """
         Check if all output files are generated
+
+        :param None snapshot: Status_snapshot to use to check files. By default
+           a new one is created.
         """
+        if snapshot is None:
+            snapshot = Status_snapshot()
+        resolved = {}
+        complete = True
         for output, fpath in self.output.items():
-            if not os.path.exists(fpath):
-                return False
-        return True
+            if is_pattern(fpath):
+                # pattern outputs are matched against the listing of the
+                # directory, at least one file is expected
+                resolved[output] = snapshot.glob(fpath)
+                complete = complete and bool(resolved[output])
+            elif not snapshot.exists(fpath):
+                complete = False
+        self.resolved_outputs = resolved
+        return complete
+
+    def resolve_output(self, key: str, snapshot: Status_snapshot=None) -> list:
+        """
+        :param key: name of the output (of the process or of a sister process)
+        :param None snapshot: Status_snapshot to use if files need to be resolved
+
+        :returns: list of files of the output: the path itself, or the files
+           matching it if it is a pattern (resolved once and kept in the run
+           state)
+        """
+        owner = self.output.owner(key)
+        path = dict.__getitem__(owner.output, key)
+        if not is_pattern(path):
+            return [path]
+        resolved = owner.__dict__.setdefault('resolved_outputs', {})
+        if key not in resolved:
+            resolved[key] = (snapshot or Status_snapshot()).glob(path)
+        return resolved[key]
 
 PROCESS_SCRIPT = '''
 #! /bin/bash
@@ -504,9 +1911,10 @@ cd {WORKDIR}
 SECONDS=0
 
 touch {WORKDIR}/.running
-rm -f {WORKDIR}/.error
+rm -f {WORKDIR}/.error {WORKDIR}/.done {WORKDIR}/.usage {WORKDIR}/.profile
 
 trap 'error_handler $LINENO $?' ERR
+trap 'error_handler $LINENO 143' TERM  # e.g. killed by the scheduler
 
 error_handler() {{
     echo $SECONDS > {WORKDIR}/.error
@@ -515,11 +1923,18 @@ error_handler() {{
 }}
 
 DONE_FILE={WORKDIR}/.done
-
+{PROFILE}
 {CMD} 2> {WORKDIR}/.command.err 1> {WORKDIR}/.command.out && echo $SECONDS > $DONE_FILE
 
+times > {WORKDIR}/.usage  # CPU time used (for the history of resources)
+
 {PUBLISH} ||  rm -f $DONE_FILE
 
+if [[ -f "$DONE_FILE" && -f {WORKDIR}/.signature.next ]]; then
+  mv -f {WORKDIR}/.signature.next {WORKDIR}/.signature
+fi
+
+{PROFILE_END}
 rm -f {WORKDIR}/.running
 
 if [[ ! -f "$DONE_FILE" ]]; then
@@ -528,3 +1943,102 @@ if [[ ! -f "$DONE_FILE" ]]; then
 fi
 
 '''
+
+BATCH_SCRIPT = '''
+#! /bin/bash
+
+# SnapFlow meta-process: runs {NPROCS} processes, {PARALLEL} at a time.
+# Each process writes its own .done or .error file.
+
+printf '%s\\n' \\
+    {SCRIPTS} \\
+  | xargs -P {PARALLEL} -n 1 /bin/bash
+'''
+
+GANG_SCRIPT = '''
+#! /bin/bash
+
+# SnapFlow gang: runs {NPROCS} processes connected by streams (named pipes) at
+# the same time. If one of them fails, the others are stopped and all are
+# marked as failed.
+
+FIFOS=({FIFOS})
+WORKDIRS=({WORKDIRS})
+CONTAINERS=({CONTAINERS})  # command prefix of each process (singularity)
+
+for fifo in "${{FIFOS[@]}}"; do
+  rm -f "$fifo"
+  mkfifo "$fifo"
+done
+
+PIDS=()
+for i in "${{!WORKDIRS[@]}}"; do
+  ${{CONTAINERS[$i]}} /bin/bash "${{WORKDIRS[$i]}}/.command.sh" &
+  PIDS+=($!)
+done
+
+FAILED=0
+stop() {{
+  [[ $FAILED == 1 ]] && return
+  FAILED=1
+  for pid in "${{PIDS[@]}}"; do
+    pkill -TERM -P $pid 2> /dev/null || true
+  done
+  # releases the processes still blocked opening a pipe
+  for fifo in "${{FIFOS[@]}}"; do
+    exec 3<> "$fifo"
+    exec 3>&-
+  done
+}}
+trap stop TERM  # e.g. killed by the scheduler
+
+for _ in "${{PIDS[@]}}"; do
+  wait -n || stop
+done
+wait
+
+if [[ $FAILED == 1 ]]; then
+  for workdir in "${{WORKDIRS[@]}}"; do
+    rm -f "$workdir/.done"
+    [[ -f "$workdir/.error" ]] || echo 0 > "$workdir/.error"
+  done
+  exit 1
+fi
+'''
+
+# sampler of the CPU and memory used by the job (optional)
+PROFILE_START = '''
+# detached from this shell (not a child process, so that a `wait` in the
+# command does not wait for it)
+if command -v python3 > /dev/null; then
+  rm -f {WORKDIR}/.profile.stop
+  MONITOR_PID=$(python3 {MONITOR} -p $$ -i {INTERVAL} -o {WORKDIR}/.profile \
+                  -s {WORKDIR}/.profile.stop > /dev/null 2>&1 & echo $!)
+fi
+'''
+
+# the sampler is stopped through a file, not a signal: a short job could end
+# before the sampler is ready to handle it
+PROFILE_END = '''if [[ -n "${{MONITOR_PID:-}}" ]]; then
+  touch {WORKDIR}/.profile.stop
+  for _ in $(seq 100); do  # waits for the profile to be written
+    kill -0 $MONITOR_PID 2> /dev/null || break
+    sleep 0.1
+  done
+  kill $MONITOR_PID 2> /dev/null || true
+  rm -f {WORKDIR}/.profile.stop
+fi
+'''
+
+ARRAY_SCRIPT = '''
+#! /bin/bash
+
+# SnapFlow job array: runs the script of the process with the given index
+# (first argument, or the array index set by the job scheduler).
+
+TASK_ID=${{1:-${{SLURM_ARRAY_TASK_ID:-${{SGE_TASK_ID:-${{LSB_JOBINDEX:-}}}}}}}}
+
+SCRIPT=$(awk -F '\\t' -v i="$TASK_ID" '$1 == i {{print $3}}' {MAP})
+
+exec /bin/bash "$SCRIPT"
+'''
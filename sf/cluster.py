@@ -0,0 +1,450 @@
+"""
+Coordinator/worker mode of `snap_scheduler`, to run a list of jobs (as
+generated by `Process_dict.write_commands`) on several machines without a
+batch system.
+
+The coordinator keeps the dependency state of the jobs (`Dependency_tracker`)
+but runs nothing itself. Workers connect to it (TCP "host:port", or path to a
+Unix socket), advertise their CPUs and memory, receive ready jobs fitting in
+their free resources, run them locally (as `sf.scheduler.Scheduler` does) and
+report their status when they end. Jobs of a worker that disconnects are
+scheduled again.
+
+TCP addresses listen on the loopback interface unless a host is given, and a
+coordinator listening on another interface only accepts workers sending its
+shared token.
+
+Messages are JSON objects, one per line, with an "op" key:
+ - worker to coordinator: "hello" (name, cpus, mem, token), "done" (jid, status)
+ - coordinator to worker: "run" (jid, job), "exit"
+"""
+
+import os
+import hmac
+import json
+import heapq
+import signal
+import socket
+import ipaddress
+import selectors
+from time import time
+
+from sf.scheduler import (Scheduler, Dependency_tracker, critical_path,
+                          job_duration, POLICIES)
+
+# fields of a job sent to workers
+JOB_FIELDS = ('name', 'rule', 'cmd', 'cpus-per-task', 'mem', 'time')
+
+
+def parse_address(address: str):
+    """
+    :param address: "host:port" for TCP (host being 127.0.0.1 if not given,
+       "0.0.0.0" for all interfaces), otherwise path to a Unix socket
+
+    :returns: socket family, and address as expected by `socket`
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+
+def is_loopback(host: str) -> bool:
+    """
+    :returns: True if a host name or IP address is on the loopback interface
+    """
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def _unlink_stale(path: str) -> None:
+    """
+    Removes a Unix socket left by a coordinator that did not exit properly.
+    """
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)  # nobody listening
+        return
+    except OSError:  # e.g. not a socket, let bind fail
+        return
+    finally:
+        probe.close()
+    raise OSError(f'ERROR: a coordinator is already listening at {path}')
+
+
+def _send(sock, message: dict) -> None:
+    sock.sendall(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+
+
+class _Connection:
+    """
+    Buffered reading of the messages received on a socket.
+    """
+    def __init__(self, sock):
+        self.sock   = sock
+        self.buffer = b''
+
+    def receive(self):
+        """
+        :returns: list of messages received (None if the connection is closed)
+        """
+        try:
+            data = self.sock.recv(65536)
+        except ConnectionError:
+            data = b''
+        if not data:
+            return None
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b'\n')
+        return [json.loads(line) for line in lines if line]
+
+
+class _Remote(_Connection):
+    """
+    Worker, as seen by the coordinator.
+    """
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.name     = None
+        self.cpus     = 0
+        self.mem      = 0
+        self.free_cpu = 0
+        self.free_mem = 0
+        self.running  = set()
+        self.hello    = False  # identified (and authenticated)
+
+
+class Coordinator:
+    """
+    Distributes jobs to workers, keeping their dependency state.
+
+    Ready jobs are assigned in priority order (job ID order with the 'greedy'
+    policy, longest remaining critical path first with 'critical-path') to the
+    worker with the fewest free CPUs among the ones where they fit.
+
+    It exposes the same attributes as `sf.scheduler.Scheduler` (resources
+    being the ones of the connected workers), so that `on_update` functions
+    can be shared.
+    """
+    def __init__(self, jobs: dict, address: str, on_update=None,
+                 refresh: float=1, policy: str='greedy', token: str=None):
+        """
+        :param jobs: dictionary of jobs as returned by `parse_jobs`
+        :param address: address to listen to ("host:port", or path to a Unix
+           socket)
+        :param None on_update: function called with the coordinator as
+           argument each time the state changes (at most once every `refresh`
+           seconds)
+        :param 1 refresh: minimum time in seconds between two calls to `on_update`
+        :param 'greedy' policy: order of ready jobs, 'greedy' or 'critical-path'
+        :param None token: secret shared with the workers, required to listen
+           on a TCP address other than the loopback interface
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"ERROR: unknown policy '{policy}', should be one "
+                             f"of: {', '.join(POLICIES)}")
+        family, sock_address = parse_address(address)
+        if family == socket.AF_INET and not is_loopback(sock_address[0]) and not token:
+            raise ValueError(f'ERROR: a token is needed to listen on {address} '
+                             '(not a loopback address)')
+        self.jobs       = jobs
+        self.address    = address
+        self.token      = token
+        self.policy     = policy
+        if policy == 'critical-path':
+            lengths  = critical_path(jobs)
+            priority = dict((jid, -lengths.get(jid, 0)) for jid in jobs)
+        else:
+            priority = None
+        self.tracker    = Dependency_tracker(jobs, priority)
+        self.workers    = {}  # socket: _Remote
+        self.procs      = {}  # job ID: worker running it
+        self.started    = {}
+        self.ended      = {}
+        self.start_time = 0
+        self.on_update  = on_update
+        self.refresh    = refresh
+        self._selector  = selectors.DefaultSelector()
+
+    @property
+    def total_cpu(self) -> int:
+        return sum(w.cpus for w in self.workers.values())
+
+    @property
+    def available_cpu(self) -> int:
+        return sum(w.free_cpu for w in self.workers.values())
+
+    @property
+    def total_mem(self) -> float:
+        return sum(w.mem for w in self.workers.values())
+
+    @property
+    def available_mem(self) -> float:
+        return sum(w.free_mem for w in self.workers.values())
+
+    def now(self) -> float:
+        return time()
+
+    def tail(self, jid: int, nlines: int=3) -> list:
+        # output of jobs stays on the workers
+        return []
+
+    def _fit(self, job: dict):
+        """
+        :returns: worker with the fewest free CPUs where the job fits (None if
+           it does not fit anywhere now)
+        """
+        fits = [w for w in self.workers.values()
+                if job['cpus-per-task'] <= w.free_cpu and job['mem'] <= w.free_mem]
+        return min(fits, key=lambda w: w.free_cpu, default=None)
+
+    def dispatch(self) -> None:
+        """
+        Assigns ready jobs, in priority order, to workers where they fit.
+        """
+        ready   = self.tracker.ready
+        waiting = []
+        while ready and any(w.free_cpu > 0 for w in self.workers.values()):
+            item = heapq.heappop(ready)
+            jid  = item[1]
+            job  = self.jobs[jid]
+            if job['status'] != 'pending':  # e.g. unsatisfiable
+                continue
+            worker = self._fit(job)
+            if worker is None:
+                waiting.append(item)
+                continue
+            self.launch(jid, worker)
+        for item in waiting:
+            heapq.heappush(ready, item)
+
+    def launch(self, jid: int, worker: _Remote) -> None:
+        job = self.jobs[jid]
+        worker.free_cpu -= job['cpus-per-task']
+        worker.free_mem -= job['mem']
+        worker.running.add(jid)
+        self.procs[jid] = worker
+        self.started[jid] = self.now()
+        job['status'] = 'running'
+        _send(worker.sock, {'op': 'run', 'jid': jid,
+                            'job': dict((k, job[k]) for k in JOB_FIELDS if k in job)})
+
+    def finish(self, jid: int, status: str) -> None:
+        worker = self.procs.pop(jid)
+        job = self.jobs[jid]
+        worker.free_cpu += job['cpus-per-task']
+        worker.free_mem += job['mem']
+        worker.running.discard(jid)
+        self.ended[jid] = self.now()
+        if status == 'done':
+            self.tracker.release(jid)
+        else:
+            self.tracker.fail(jid, status)
+
+    def _accept(self, listener) -> None:
+        sock, _ = listener.accept()
+        worker = _Remote(sock)
+        self.workers[sock] = worker
+        self._selector.register(sock, selectors.EVENT_READ, worker)
+
+    def _drop(self, worker: _Remote) -> None:
+        """
+        Forgets a disconnected worker, its jobs are scheduled again.
+        """
+        self._selector.unregister(worker.sock)
+        worker.sock.close()
+        del self.workers[worker.sock]
+        for jid in worker.running:
+            del self.procs[jid]
+            del self.started[jid]
+            self.jobs[jid]['status'] = 'pending'
+            self.tracker.push(jid)
+
+    def _receive(self, worker: _Remote) -> None:
+        messages = worker.receive()
+        if messages is None:
+            self._drop(worker)
+            return
+        for message in messages:
+            if message['op'] == 'hello':
+                if self.token and not hmac.compare_digest(
+                        str(message.get('token') or '').encode(), self.token.encode()):
+                    self._drop(worker)
+                    return
+                worker.hello = True
+                worker.name  = message['name']
+                worker.cpus  = worker.free_cpu = message['cpus']
+                worker.mem   = worker.free_mem = message['mem']
+            elif not worker.hello:  # must introduce itself first
+                self._drop(worker)
+                return
+            elif message['op'] == 'done' and message['jid'] in worker.running:
+                self.finish(message['jid'], message['status'])
+
+    def _update(self, force: bool=False) -> None:
+        if self.on_update is None:
+            return
+        now = time()
+        if force or now - self._last_update >= self.refresh:
+            self._last_update = now
+            self.on_update(self)
+
+    def run(self) -> None:
+        """
+        Run all jobs, returns when there is nothing left to run (once at
+        least one worker is connected).
+        """
+        family, address = parse_address(self.address)
+        listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            _unlink_stale(address)
+        listener.bind(address)
+        listener.listen()
+        self._selector.register(listener, selectors.EVENT_READ)
+        self._last_update = 0
+        self.start_time   = self.now()
+        try:
+            while True:
+                self.dispatch()
+                if not self.procs and any(w.cpus for w in self.workers.values()):
+                    # nothing running: remaining ready jobs do not fit in any
+                    # worker and will never run
+                    for _, jid in self.tracker.ready:
+                        if self.jobs[jid]['status'] == 'pending':
+                            self.ended[jid] = self.now()
+                            self.tracker.fail(jid)
+                    self.tracker.ready.clear()
+                    break
+                self._update()
+                for key, _ in self._selector.select(
+                        self.refresh if self.on_update else None):
+                    if key.data is None:
+                        self._accept(listener)
+                    elif key.fileobj in self.workers:
+                        self._receive(key.data)
+            self._update(force=True)
+        finally:
+            for worker in list(self.workers.values()):
+                try:
+                    _send(worker.sock, {'op': 'exit'})
+                except OSError:
+                    pass
+                worker.sock.close()
+            self._selector.close()
+            listener.close()
+            if family == socket.AF_UNIX:
+                os.unlink(address)
+
+
+class Worker(Scheduler):
+    """
+    Runs the jobs received from a `Coordinator`, within its own CPUs and
+    memory (with the same options as `sf.scheduler.Scheduler` to enforce
+    limits and keep the output of jobs).
+    """
+    def __init__(self, address: str, total_cpu: int, total_mem: float,
+                 name: str=None, token: str=None, **kwargs):
+        """
+        :param address: address of the coordinator ("host:port", or path to a
+           Unix socket)
+        :param total_cpu: number of CPUs offered to the coordinator
+        :param total_mem: amount of memory (Gb) offered to the coordinator
+        :param None name: name of the worker (by default host name and PID)
+        :param None token: secret shared with the coordinator
+        :param kwargs: other arguments of `sf.scheduler.Scheduler` (e.g.
+           `enforce` or `log_dir`)
+        """
+        super().__init__({}, total_cpu, total_mem, **kwargs)
+        self.address    = address
+        self.name       = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.token      = token
+        self.connection = None
+        self._exit      = False
+
+    def dispatch(self) -> None:
+        # jobs are launched when received, except the ones waiting for a free
+        # worker of the pool of Python workers
+        waiting = []
+        while self.tracker.ready:
+            item = heapq.heappop(self.tracker.ready)
+            if self._pool_full(item[1]):
+                waiting.append(item)
+            else:
+                self.launch(item[1])
+        for item in waiting:
+            heapq.heappush(self.tracker.ready, item)
+
+    def finish(self, jid: int, return_code: int) -> None:
+        super().finish(jid, return_code)
+        job = self.jobs.pop(jid)
+        for registry in (self.durations, self.started, self.ended,
+                         self.tracker.children, self.calls):
+            registry.pop(jid, None)
+        try:
+            _send(self.connection.sock, {'op': 'done', 'jid': jid,
+                                         'status': job['status']})
+        except OSError:  # coordinator gone
+            pass
+
+    def _receive(self) -> None:
+        messages = self.connection.receive()
+        if messages is None:
+            # coordinator gone: stop once running jobs end
+            self._selector.unregister(self.connection.sock)
+            self._exit = True
+            return
+        for message in messages:
+            if message['op'] == 'run':
+                jid = message['jid']
+                job = message['job']
+                job['status'] = 'pending'
+                self.jobs[jid] = job
+                self.durations[jid] = job_duration(job)
+                self.tracker.push(jid)
+                self.dispatch()
+            elif message['op'] == 'exit':
+                self._exit = True
+
+    def run(self) -> None:
+        """
+        Runs the jobs received until the coordinator says there is nothing
+        left to run.
+        """
+        family, address = parse_address(self.address)
+        sock = socket.create_connection(address) if family == socket.AF_INET \
+            else socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            sock.connect(address)
+        self.connection = _Connection(sock)
+        _send(sock, {'op': 'hello', 'name': self.name, 'cpus': self.total_cpu,
+                     'mem': self.total_mem, 'token': self.token})
+        if not self._use_pidfd:
+            self._watch_sigchld()
+        self._selector.register(sock, selectors.EVENT_READ, self._receive)
+        self._last_update = 0
+        self.start_time   = self.now()
+        while not self._exit or self.procs:
+            self.dispatch()
+            self._update()
+            self.wait(self._timeout())
+        self._update(force=True)
+        sock.close()
+        self._selector.close()
+        if self.limits is not None:
+            self.limits.close()
+        if self._pool is not None:
+            self._pool.shutdown()
+            for fd in self._calls_pipe:
+                os.close(fd)
+        if self._sigchld_pipe is not None:
+            signal.set_wakeup_fd(-1)
+            for fd in self._sigchld_pipe:
+                os.close(fd)
@@ -0,0 +1,191 @@
+"""
+Live views of the state of `sf.scheduler.Scheduler`, to be passed as its
+`on_update` function:
+ - `Dashboard`: terminal dashboard redrawing only the lines that changed.
+ - `Json_lines`: one JSON object per update, for batch environments.
+
+Both show the same information (see `summary`): CPU and memory used, number
+of jobs per rule and status, running jobs (with the last lines of their
+output) and the latest failures.
+"""
+
+import sys
+import json
+import shutil
+
+from sf.IO_utils.bash_utils import color_status
+from sf.IO_utils.time_utils import seconds_to_time
+
+# order of the status columns
+STATUSES = ('done', 'running', 'pending', 'dependent', 'error', 'oom',
+            'timeout', 'unsatisfiable')
+
+FAILED = ('error', 'oom', 'timeout')
+
+
+def job_rule(job: dict) -> str:
+    """
+    :returns: rule of a job (its name for jobs not generated by SnapFlow)
+    """
+    return job.get('rule', job['name'])
+
+
+def summary(scheduler, max_running: int=50, max_failures: int=10,
+            tail: int=0) -> dict:
+    """
+    :param scheduler: `sf.scheduler.Scheduler` instance
+    :param 50 max_running: maximum number of running jobs listed (longest
+       running first)
+    :param 10 max_failures: maximum number of failed jobs listed (latest
+       first)
+    :param 0 tail: number of lines of output listed for each running job
+
+    :returns: dictionary with the state of the scheduler
+    """
+    now = scheduler.now()
+    counts = {}
+    for job in scheduler.jobs.values():
+        rule = counts.setdefault(job_rule(job), {})
+        rule[job['status']] = rule.get(job['status'], 0) + 1
+    running = []
+    for jid in sorted(scheduler.procs, key=scheduler.started.get)[:max_running]:
+        job = scheduler.jobs[jid]
+        running.append({
+            'jid'    : jid,
+            'name'   : job['name'],
+            'rule'   : job_rule(job),
+            'cpus'   : job['cpus-per-task'],
+            'mem'    : job['mem'],
+            'elapsed': round(now - scheduler.started[jid]),
+            'tail'   : scheduler.tail(jid, tail) if tail else [],
+            })
+    failed = sorted((jid for jid in scheduler.ended
+                     if scheduler.jobs[jid]['status'] in FAILED),
+                    key=scheduler.ended.get, reverse=True)
+    failures = [{'jid'   : jid,
+                 'name'  : scheduler.jobs[jid]['name'],
+                 'status': scheduler.jobs[jid]['status']}
+                for jid in failed[:max_failures]]
+    return {
+        'elapsed' : round(now - scheduler.start_time),
+        'cpus'    : {'used': scheduler.total_cpu - scheduler.available_cpu,
+                     'total': scheduler.total_cpu},
+        'mem'     : {'used': round(scheduler.total_mem - scheduler.available_mem, 1),
+                     'total': scheduler.total_mem},
+        'rules'   : counts,
+        'running' : running,
+        'nrunning': len(scheduler.procs),
+        'failures': failures,
+        'nfailed' : len(failed),
+        }
+
+
+def _bar(used: float, total: float, width: int=20) -> str:
+    filled = min(width, round(width * used / total)) if total else 0
+    return '[' + '#' * filled + '.' * (width - filled) + ']'
+
+
+class Dashboard:
+    """
+    Terminal dashboard. Only the lines that changed since the previous update
+    are rewritten (using ANSI escape codes), and the view is cut to the size
+    of the terminal.
+    """
+    def __init__(self, stream=None, tail: int=2, max_failures: int=5):
+        """
+        :param None stream: output stream (standard output by default)
+        :param 2 tail: number of lines of output shown for each running job
+        :param 5 max_failures: number of failed jobs shown (latest first)
+        """
+        self.stream       = stream or sys.stdout
+        self.tail         = tail
+        self.max_failures = max_failures
+        self._previous    = None  # lines drawn in the previous update
+
+    def lines(self, state: dict, width: int, height: int) -> list:
+        """
+        :returns: list of lines to draw for a state returned by `summary`
+        """
+        cpus, mem = state['cpus'], state['mem']
+        lines = [
+            f"SnapFlow scheduler - elapsed {seconds_to_time(state['elapsed'])}",
+            f"CPUs {_bar(cpus['used'], cpus['total'])} {cpus['used']}/{cpus['total']}   "
+            f"Mem {_bar(mem['used'], mem['total'])} {mem['used']:.1f}/{mem['total']:.1f} Gb",
+            '',
+            ]
+        statuses = [s for s in STATUSES
+                    if any(s in c for c in state['rules'].values())]
+        rule_w = max([len('rule')] + [len(r) for r in state['rules']])
+        rule_w = min(rule_w, max(10, width - 14 * len(statuses)))
+        lines.append(f"{'rule':<{rule_w}}" +
+                     ''.join(f'{s:>14}' for s in statuses))
+        for rule, counts in sorted(state['rules'].items()):
+            lines.append(f'{rule[:rule_w]:<{rule_w}}' +
+                         ''.join(f'{counts.get(s, 0):>14}' for s in statuses))
+        failures = []
+        if state['failures']:
+            failures.append('')
+            failures.append(f"Failed jobs ({state['nfailed']}, latest first):")
+            for failure in state['failures']:
+                failures.append(f"  {color_status(failure['status'], l_align=16)}"
+                                f"{failure['name'][:width - 19]}")
+        lines.append('')
+        lines.append(f"Running jobs ({state['nrunning']}):")
+        # running jobs get the room left by the other sections
+        room = height - len(lines) - len(failures) - 1
+        for job in state['running']:
+            block = [f"  {seconds_to_time(job['elapsed']):>10} {job['cpus']:>3} CPUs "
+                     f"{job['mem']:>4} Gb  {job['name']}"[:width]]
+            block.extend(f"      | {line}"[:width] for line in job['tail'])
+            if len(block) > room:
+                lines.append('  ...')
+                break
+            lines.extend(block)
+            room -= len(block)
+        return lines + failures
+
+    def draw(self, state: dict) -> None:
+        width, height = shutil.get_terminal_size()
+        lines = self.lines(state, width, height)
+        out = []
+        if self._previous is None:
+            out.append('\033[?25l\033[2J')  # hide cursor, clear screen
+            self._previous = []
+        for num, line in enumerate(lines):
+            if num >= len(self._previous) or self._previous[num] != line:
+                out.append(f'\033[{num + 1};1H{line}\033[K')
+        if len(lines) < len(self._previous):
+            out.append(f'\033[{len(lines) + 1};1H\033[J')
+        self._previous = lines
+        self.stream.write(''.join(out))
+        self.stream.flush()
+
+    def __call__(self, scheduler) -> None:
+        self.draw(summary(scheduler, max_running=shutil.get_terminal_size()[1],
+                          max_failures=self.max_failures, tail=self.tail))
+
+    def close(self) -> None:
+        if self._previous is not None:
+            self.stream.write(f'\033[{len(self._previous) + 1};1H\033[?25h')
+            self.stream.flush()
+
+
+class Json_lines:
+    """
+    Writes the state of the scheduler as one JSON object per line.
+    """
+    def __init__(self, stream=None, tail: int=0):
+        """
+        :param None stream: output stream (standard output by default)
+        :param 0 tail: number of lines of output listed for each running job
+        """
+        self.stream = stream or sys.stdout
+        self.tail   = tail
+
+    def __call__(self, scheduler) -> None:
+        self.stream.write(json.dumps(summary(scheduler, tail=self.tail),
+                                     separators=(',', ':')) + '\n')
+        self.stream.flush()
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,117 @@
+from collections import deque
+
+
+class CycleError(ValueError):
+    """Exception raised when the dependencies between processes form a cycle."""
+    def __init__(self, names):
+        self.names = names
+        self.message = ("Cycle detected in the dependencies of processes: "
+                        f"{', '.join(sorted(names))}")
+        super().__init__(self.message)
+
+
+class Process_graph:
+    """
+    Index of the dependencies between processes (by process name).
+
+    It holds forward (`parents`: processes a process depends on) and reverse
+    (`children`: processes depending on a process) adjacency, and a
+    topological order that is extended in place as long as processes are
+    added after their dependencies (which is the case when they are created
+    through rules).
+    """
+    def __init__(self):
+        self.parents      = {}
+        self.children     = {}
+        self._order       = []
+        self._in_order    = set()
+        self._sorted      = True
+        self._ancestors   = {}
+        self._descendants = {}
+
+    def __contains__(self, name) -> bool:
+        return name in self.parents
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def add(self, name: str, dependencies) -> None:
+        """
+        :param name: name of the process
+        :param dependencies: names of the processes it depends on
+        """
+        self.parents[name] = set(dependencies)
+        self.children.setdefault(name, set())
+        for dep in self.parents[name]:
+            self.children.setdefault(dep, set()).add(name)
+        if self._sorted and self._in_order.issuperset(self.parents[name]):
+            self._order.append(name)
+            self._in_order.add(name)
+        else:
+            self._sorted = False
+        if self._ancestors or self._descendants:
+            self._ancestors.clear()
+            self._descendants.clear()
+
+    def topological_order(self) -> list:
+        """
+        :returns: list of process names, each process placed after all its
+           dependencies. Dependencies on unknown processes are ignored.
+        """
+        if not self._sorted:
+            self._order = self._sort()
+            self._in_order = set(self._order)
+            self._sorted = True
+        return self._order
+
+    def _sort(self) -> list:
+        # Kahn's algorithm, following insertion order when possible
+        indegree = dict((name, sum(1 for d in deps if d in self.parents))
+                        for name, deps in self.parents.items())
+        queue = deque(name for name, n in indegree.items() if n == 0)
+        order = []
+        while queue:
+            name = queue.popleft()
+            order.append(name)
+            for child in self.children[name]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    queue.append(child)
+        if len(order) != len(self.parents):
+            raise CycleError(set(self.parents).difference(order))
+        return order
+
+    def check_cycles(self) -> None:
+        """
+        Raises CycleError if the dependencies form a cycle.
+        """
+        self.topological_order()
+
+    def ancestors(self, name: str) -> frozenset:
+        """
+        :returns: all processes `name` depends on, directly or not (cached)
+        """
+        return self._closure(name, self.parents, self._ancestors)
+
+    def descendants(self, name: str) -> frozenset:
+        """
+        :returns: all processes depending on `name`, directly or not (cached)
+        """
+        return self._closure(name, self.children, self._descendants)
+
+    @staticmethod
+    def _closure(name, edges, cache) -> frozenset:
+        try:
+            return cache[name]
+        except KeyError:
+            pass
+        seen = set()
+        to_visit = list(edges.get(name, ()))
+        while to_visit:
+            other = to_visit.pop()
+            if other in seen:
+                continue
+            seen.add(other)
+            to_visit.extend(edges.get(other, ()))
+        cache[name] = frozenset(seen)
+        return cache[name]
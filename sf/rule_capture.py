@@ -0,0 +1,161 @@
+"""
+Capture of the variables defined by rule functions (`input_`, `output`, `cmd`
+and `publish`).
+
+Rule functions may either return them explicitly (e.g. `return locals()`), or
+just define them as local variables. In the second case the local variables
+are read when the rule function returns:
+ - with Python >= 3.12, through `sys.monitoring`, with an event attached only
+   to the code object of the rule function: nested calls inside the rule (e.g.
+   `IO_type` construction or helper functions) are not seen at all.
+ - with older versions, through `sys.setprofile`, filtered on the code object
+   of the rule function. Any profiler already running in Python is kept, and
+   called for all events. Profilers implemented in C (e.g. cProfile) can not
+   be chained, `sys.settrace` is then used instead.
+"""
+
+import sys
+
+RULE_VARS = ('input_', 'output', 'cmd')
+
+# code objects of rule functions returning their variables explicitly
+_EXPLICIT = set()
+
+# variables captured at the return of rule functions (a stack, as rule
+# functions may call other rules)
+_captured = []
+
+_TOOL_NAME = 'SnapFlow'
+_tool_id   = None
+_monitored = set()
+
+
+def _is_rule_vars(value) -> bool:
+    return isinstance(value, dict) and all(k in value for k in RULE_VARS)
+
+
+def _on_return(code, offset, retval):
+    # called only at the return of monitored rule functions, the caller frame
+    # is the one of the rule function
+    _captured.append(dict(sys._getframe(1).f_locals))
+
+
+def _get_tool_id():
+    """
+    :returns: sys.monitoring tool ID used by SnapFlow (registered at first use),
+       None if all tool IDs are already in use
+    """
+    global _tool_id
+    if _tool_id is not None:
+        return _tool_id
+    monitoring = sys.monitoring
+    # IDs not reserved to debuggers, coverage tools or profilers
+    for tool_id in (3, 4, monitoring.OPTIMIZER_ID):
+        if monitoring.get_tool(tool_id) is None:
+            break
+    else:
+        return None
+    monitoring.use_tool_id(tool_id, _TOOL_NAME)
+    monitoring.register_callback(tool_id, monitoring.events.PY_RETURN, _on_return)
+    _tool_id = tool_id
+    return _tool_id
+
+
+def _call_monitored(func, code, args, kwargs):
+    tool_id = _get_tool_id()
+    if tool_id is None:
+        return _call_profiled(func, code, args, kwargs)
+    if code not in _monitored:
+        sys.monitoring.set_local_events(tool_id, code, sys.monitoring.events.PY_RETURN)
+        _monitored.add(code)
+    depth = len(_captured)
+    try:
+        result = func(*args, **kwargs)
+    except BaseException:
+        del _captured[depth:]
+        raise
+    rule_vars = _captured.pop() if len(_captured) > depth else {}
+    return result, rule_vars
+
+
+def _call_profiled(func, code, args, kwargs):
+    rule_vars = {}
+    previous = sys.getprofile()
+    if previous is not None and not callable(previous):
+        # profiler implemented in C (e.g. cProfile), it can not be chained
+        return _call_traced(func, code, args, kwargs)
+
+    def tracer(frame, event, arg):
+        if event == 'return' and frame.f_code is code:
+            rule_vars.update(frame.f_locals)
+        if previous is not None:
+            previous(frame, event, arg)
+
+    sys.setprofile(tracer)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        sys.setprofile(previous)
+    return result, rule_vars
+
+
+def _call_traced(func, code, args, kwargs):
+    rule_vars = {}
+    previous = sys.gettrace()
+    if previous is not None and not callable(previous):
+        raise RuntimeError(
+            f'ERROR: can not collect the variables of rule {func.__name__} while '
+            'a profiler and a tracer are running, the rule function should '
+            'return them explicitly (e.g. `return locals()`)')
+
+    def local_tracer(frame, event, arg):
+        if event == 'return':
+            rule_vars.update(frame.f_locals)
+        return local_tracer
+
+    def tracer(frame, event, arg):
+        if frame.f_code is code:
+            return local_tracer
+        if previous is not None:
+            return previous(frame, event, arg)
+        return None
+
+    sys.settrace(tracer)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        sys.settrace(previous)
+    return result, rule_vars
+
+
+def capture_rule_vars(func, args, kwargs) -> dict:
+    """
+    Calls a rule function and collects the variables it defines.
+
+    :param func: rule function (undecorated)
+    :param args: positional arguments of the call
+    :param kwargs: keyword arguments of the call
+
+    :returns: dictionary of variables defined by the rule function
+    """
+    code = func.__code__
+    if code in _EXPLICIT:
+        result = func(*args, **kwargs)
+        rule_vars = result if _is_rule_vars(result) else {}
+    else:
+        if hasattr(sys, 'monitoring'):
+            result, rule_vars = _call_monitored(func, code, args, kwargs)
+        else:
+            result, rule_vars = _call_profiled(func, code, args, kwargs)
+        if _is_rule_vars(result):
+            # explicit return: no need to capture anything in later calls
+            _EXPLICIT.add(code)
+            _unmonitor(code)
+            rule_vars = result
+    return rule_vars
+
+
+def _unmonitor(code) -> None:
+    if code in _monitored:
+        sys.monitoring.set_local_events(_tool_id, code, 0)
+        _monitored.discard(code)
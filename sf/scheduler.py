@@ -0,0 +1,771 @@
+import os
+import signal
+import heapq
+import selectors
+from collections        import defaultdict
+from subprocess         import Popen, DEVNULL, STDOUT
+from time               import time
+from multiprocessing    import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from sf.IO_utils.time_utils  import time_to_seconds
+from sf.IO_utils.bash_utils  import tail
+from sf.IO_utils.job_limits  import Job_limits
+from sf.IO_utils.journal     import (Journal, Adopted, job_workdir, marker_status,
+                                     process_start_time)
+from sf.IO_utils.python_call import load_call, preload, run_process
+
+# scheduling policies of `Scheduler`
+POLICIES = ('greedy', 'critical-path')
+
+
+def parse_jobs(fh):
+    """
+    Parse the list of jobs generated by `Process_dict.write_commands`.
+
+    Each line is a command, optionally preceded by a string between brackets
+    with the job specifications (e.g.: "[name foo;cpus-per-task 2;depe 1,3] cmd")
+
+    Job arrays ("array 1-N") are expanded into N jobs, each running the command
+    with the task index as last argument. Their names are read from the
+    "array-map" file if available. A dependency on an array ("depe") waits for
+    all its tasks, a correlated dependency ("depe-corr") makes each task wait
+    only for the task with the same index.
+
+    :param fh: iterable of lines
+
+    :returns: a dictionary of jobs indexed by job ID (line number, starting at
+       1, if there are no job arrays)
+    """
+    lines = []
+    for num, cmd in enumerate(fh, 1):
+        job = {
+            'cpus-per-task': 1,
+            'mem'          : 1,
+            'time'         : '2h',
+            'qos'          : 'local',
+            'name'         : f'job_{num}',
+            'depe'         : set(),
+            'status'       : 'pending',
+            }
+
+        if cmd.startswith('['):
+            inargs = dict(c.split(' ', 1)
+                          for c in cmd[1:].split('] ')[0].strip().split(';'))
+            for depe in ('depe', 'depe-corr'):
+                if depe in inargs:
+                    inargs[depe] = set([int(d) for d in inargs[depe].split(',')])
+                    inargs['status'] = 'dependent'
+            job.update(inargs)
+            job['cmd'] = cmd.split(']')[1].strip()
+            job['cpus-per-task'] = int(job['cpus-per-task'])
+            job['mem'] = float(job['mem'])
+        else:
+            job['cmd'] = cmd.strip()
+        lines.append(job)
+
+    # job IDs of each line (several in the case of arrays)
+    jids_of = {}
+    jid = 0
+    for num, job in enumerate(lines, 1):
+        first, last = [int(v) for v in job.get('array', '1-1').split('-')]
+        jids_of[num] = list(range(jid + 1, jid + 2 + last - first))
+        jid += 1 + last - first
+
+    jobs = {}
+    for num, job in enumerate(lines, 1):
+        if 'array' not in job:
+            (jid, ) = jids_of[num]
+            job['depe'] = set(d for dep in job['depe'] for d in jids_of[dep])
+            jobs[jid] = job
+            continue
+        first = int(job['array'].split('-')[0])
+        names = _array_names(job.get('array-map'))
+        for pos, jid in enumerate(jids_of[num]):
+            idx = first + pos
+            task = dict((k, v) for k, v in job.items()
+                        if k not in ('array', 'array-map', 'depe-corr'))
+            task['name'] = names.get(idx, f"{job['name']}_{idx}")
+            task['cmd']  = f"{job['cmd']} {idx}"
+            task['depe'] = set(d for dep in job['depe'] for d in jids_of[dep])
+            task['depe'].update(jids_of[dep][pos] for dep in job.get('depe-corr', ()))
+            jobs[jid] = task
+    return jobs
+
+
+def _array_names(path) -> dict:
+    """
+    :returns: process name for each task index of an array (empty if the
+       mapping file is not readable)
+    """
+    names = {}
+    try:
+        with open(path, encoding='utf-8') as fh:
+            for line in fh:
+                idx, name, _ = line.rstrip('\n').split('\t', 2)
+                names[int(idx)] = name
+    except (TypeError, OSError):
+        pass
+    return names
+
+
+def job_duration(job: dict) -> int:
+    """
+    :returns: declared time of a job in seconds (2 hours if it can not be read)
+    """
+    try:
+        return time_to_seconds(job['time'])
+    except (KeyError, ValueError):
+        return 7200
+
+
+def critical_path(jobs: dict, durations: dict=None) -> dict:
+    """
+    Remaining critical path of each job: its own duration plus the longest
+    chain of jobs depending on it.
+
+    :param jobs: dictionary of jobs as returned by `parse_jobs`
+    :param None durations: duration in seconds of each job (by default their
+       declared time)
+
+    :returns: dictionary with the length in seconds of the critical path
+       starting at each job
+    """
+    if durations is None:
+        durations = dict((jid, job_duration(job)) for jid, job in jobs.items())
+    children = defaultdict(list)
+    for jid, job in jobs.items():
+        for dep in job['depe']:
+            if dep in jobs:
+                children[dep].append(jid)
+    # reverse topological order: a job is visited once all its dependents are
+    remaining = dict((jid, len(children[jid])) for jid in jobs)
+    to_visit = [jid for jid, n in remaining.items() if n == 0]
+    lengths = {}
+    while to_visit:
+        jid = to_visit.pop()
+        lengths[jid] = durations[jid] + max((lengths[c] for c in children[jid]),
+                                            default=0)
+        for dep in jobs[jid]['depe']:
+            if dep in jobs:
+                remaining[dep] -= 1
+                if remaining[dep] == 0:
+                    to_visit.append(dep)
+    return lengths
+
+
+class Dependency_tracker:
+    """
+    Keeps the dependency state of a list of jobs (as returned by `parse_jobs`).
+
+    Each job has a counter of unfinished dependencies (in-degree), when it
+    reaches zero the job is pushed into the ready queue. Finishing a job only
+    visits its direct dependents.
+    """
+    def __init__(self, jobs: dict, priority: dict=None):
+        """
+        :param jobs: dictionary of jobs as returned by `parse_jobs`
+        :param None priority: rank of each job in the ready queue (lowest
+           first, ties broken by job ID). By default jobs are ready in job ID
+           order.
+        """
+        self.jobs     = jobs
+        self.priority = priority or {}
+        self.children = defaultdict(list)
+        self.indegree = {}
+        self.ready    = []  # heap of (rank, job ID) ready to be run
+        for jid, job in jobs.items():
+            self.indegree[jid] = len(job['depe'])
+            for dep in job['depe']:
+                self.children[dep].append(jid)
+        for jid, job in jobs.items():
+            if self.indegree[jid] == 0:
+                self.push(jid)
+
+    def push(self, jid: int) -> None:
+        heapq.heappush(self.ready, (self.priority.get(jid, 0), jid))
+
+    def add(self, jid: int, job: dict) -> None:
+        """
+        Adds a job created while running (e.g. by a dynamic fan-out), its
+        dependencies being jobs already known. It is unsatisfiable if one of
+        them failed.
+        """
+        self.jobs[jid] = job
+        self.indegree[jid] = 0
+        job['status'] = 'pending'
+        for dep in job['depe']:
+            self.children[dep].append(jid)
+            status = self.jobs[dep]['status']
+            if status == 'done':
+                continue
+            self.indegree[jid] += 1
+            if status in ('error', 'oom', 'timeout', 'unsatisfiable'):
+                job['status'] = 'unsatisfiable'
+            elif job['status'] == 'pending':
+                job['status'] = 'dependent'
+        if job['status'] == 'pending':
+            self.push(jid)
+
+    def release(self, jid: int) -> None:
+        """
+        Mark job as done and push dependents with no pending dependency
+        into the ready queue.
+        """
+        self.jobs[jid]['status'] = 'done'
+        for child in self.children[jid]:
+            self.indegree[child] -= 1
+            if self.indegree[child] == 0 and self.jobs[child]['status'] == 'dependent':
+                self.jobs[child]['status'] = 'pending'
+                self.push(child)
+
+    def fail(self, jid: int, status: str='error') -> None:
+        """
+        Mark job as failed, and all its descendants as unsatisfiable.
+        """
+        self.jobs[jid]['status'] = status
+        to_visit = list(self.children[jid])
+        while to_visit:
+            child = to_visit.pop()
+            if self.jobs[child]['status'] == 'unsatisfiable':
+                continue
+            self.jobs[child]['status'] = 'unsatisfiable'
+            to_visit.extend(self.children[child])
+
+
+class Scheduler:
+    """
+    Event-driven local job scheduler.
+
+    The scheduler sleeps until a child process exits (using a pidfd per job
+    when available, or a SIGCHLD wake-up otherwise), dispatches ready jobs that
+    fit in the available resources, and releases the dependents of finished
+    jobs.
+
+    Two policies are available:
+     - 'greedy': ready jobs are launched in job ID order as long as they fit.
+     - 'critical-path': ready jobs are ranked by the length of their remaining
+       critical path (from declared times). When the first one does not fit, it
+       gets a reservation at the earliest time enough resources are freed by
+       running jobs, and other jobs are only launched (backfilled) if they end
+       before that time or use resources that it will not need.
+
+    With `enforce`, jobs are killed when they use more memory than declared
+    (status 'oom') or run longer than their declared time (status 'timeout'),
+    see `sf.IO_utils.job_limits`.
+
+    With a `journal`, the jobs started and ended are recorded, and a new run
+    with the same list of jobs resumes the previous one (see `resume`).
+
+    With `python_workers`, processes backed by a Python function (see
+    `sf.Python_call`) are run by a pool of persistent Python processes, with
+    the modules of their functions imported once per worker (their memory and
+    time limits are not enforced).
+    """
+    def __init__(self, jobs: dict, total_cpu: int, total_mem: float,
+                 on_update=None, refresh: float=0.1, policy: str='greedy',
+                 enforce: bool=False, kill_grace: float=10, log_dir: str=None,
+                 journal: str=None, python_workers: int=0):
+        """
+        :param jobs: dictionary of jobs as returned by `parse_jobs`
+        :param total_cpu: number of CPUs to be used in total
+        :param total_mem: amount of memory (Gb) to be used in total
+        :param None on_update: function called with the scheduler as argument
+           each time the state changes (at most once every `refresh` seconds)
+        :param 0.1 refresh: minimum time in seconds between two calls to `on_update`
+        :param 'greedy' policy: scheduling policy, 'greedy' or 'critical-path'
+        :param False enforce: kill jobs exceeding their memory or time
+        :param 10 kill_grace: seconds between SIGTERM and SIGKILL for jobs
+           exceeding their time
+        :param None log_dir: directory where the output (stdout and stderr)
+           of each job is written, in a file named after its job ID and name
+           (see `log_path`). By default the output is discarded.
+        :param None journal: path to the journal of the run
+        :param 0 python_workers: number of persistent Python processes running
+           the processes backed by a Python function (0 to run them, as any
+           other job, through their `.command.sh`)
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"ERROR: unknown policy '{policy}', should be one "
+                             f"of: {', '.join(POLICIES)}")
+        self.jobs          = jobs
+        self.policy        = policy
+        self.durations     = dict((jid, job_duration(job)) for jid, job in jobs.items())
+        if policy == 'critical-path':
+            lengths  = critical_path(jobs, self.durations)
+            priority = dict((jid, -lengths.get(jid, 0)) for jid in jobs)
+        else:
+            priority = None
+        self.tracker       = Dependency_tracker(jobs, priority)
+        self.started       = {}
+        self.ended         = {}
+        self.start_time    = 0  # set when run starts
+        self.total_cpu     = total_cpu
+        self.total_mem     = total_mem
+        self.available_cpu = total_cpu
+        self.available_mem = total_mem
+        self.on_update     = on_update
+        self.refresh       = refresh
+        self.procs         = {}
+        self.limits        = Job_limits(kill_grace) if enforce else None
+        self.log_dir       = log_dir
+        self.journal       = None if journal is None else Journal(journal, jobs)
+        if log_dir is not None:
+            os.makedirs(log_dir, exist_ok=True)
+        self._selector     = selectors.DefaultSelector()
+        self._use_pidfd    = _pidfd_supported()
+        self._sigchld_pipe = None
+        # working directory of the jobs run by the pool of Python workers
+        # (None for other jobs), filled as jobs are seen (see `pooled`)
+        self.python_workers = python_workers
+        self.calls          = {}
+        self._modules       = set()
+        self._pool          = None
+        self._pool_busy     = 0  # calls submitted to the pool and not ended
+        self._calls_pipe    = None
+
+    def now(self) -> float:
+        return time()
+
+    def dispatch(self) -> None:
+        """
+        Launch, in priority order, ready jobs that fit in the available
+        resources (and, with the 'critical-path' policy, that do not delay the
+        first job waiting for resources).
+        """
+        ready       = self.tracker.ready
+        waiting     = []
+        reservation = None
+        now         = self.now()
+        while ready and self.available_cpu > 0:
+            item = heapq.heappop(ready)
+            jid  = item[1]
+            job  = self.jobs[jid]
+            if job['status'] != 'pending':  # e.g. unsatisfiable
+                continue
+            if self._pool_full(jid):
+                # no resource reserved for calls queued in the pool
+                waiting.append(item)
+                continue
+            if (job['cpus-per-task'] > self.available_cpu or
+                job['mem'] > self.available_mem):
+                waiting.append(item)
+                if self.policy == 'critical-path' and reservation is None:
+                    reservation = self._reserve(job, now)
+                continue
+            if reservation is not None:
+                shadow, spare_cpu, spare_mem = reservation
+                if now + self.durations[jid] > shadow:
+                    # still running when the reserved job starts
+                    if job['cpus-per-task'] > spare_cpu or job['mem'] > spare_mem:
+                        waiting.append(item)
+                        continue
+                    reservation = (shadow, spare_cpu - job['cpus-per-task'],
+                                   spare_mem - job['mem'])
+            self.launch(jid)
+        for item in waiting:
+            heapq.heappush(ready, item)
+
+    def _reserve(self, job: dict, now: float):
+        """
+        Finds when a job that does not fit now could start, from the declared
+        time of running jobs.
+
+        :returns: the start time of the job, and the CPUs and memory that it
+           leaves free at that time. None if the job never fits.
+        """
+        cpus, mem = self.available_cpu, self.available_mem
+        for end, jid in sorted((self.started[j] + self.durations[j], j)
+                               for j in self.procs):
+            cpus += self.jobs[jid]['cpus-per-task']
+            mem  += self.jobs[jid]['mem']
+            if job['cpus-per-task'] <= cpus and job['mem'] <= mem:
+                return (max(end, now), cpus - job['cpus-per-task'],
+                        mem - job['mem'])
+        return None
+
+    def launch(self, jid: int) -> None:
+        job = self.jobs[jid]
+        self.available_cpu -= job['cpus-per-task']
+        self.available_mem -= job['mem']
+        self.started[jid] = self.now()
+        job['status'] = 'running'
+        self.procs[jid] = self.start(jid)
+        if self.journal is not None:
+            self.journal.started(jid, self.procs[jid].pid)
+
+    def adopt(self, jid: int, pid: int, started: float) -> bool:
+        """
+        Follows a job started by a previous run of the scheduler.
+
+        :returns: False if the job is not running anymore
+        """
+        proc = Adopted(pid, self.jobs[jid])
+        if self._use_pidfd:
+            try:
+                fd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                return False
+            self._selector.register(fd, selectors.EVENT_READ, jid)
+        job = self.jobs[jid]
+        self.available_cpu -= job['cpus-per-task']
+        self.available_mem -= job['mem']
+        self.started[jid] = started
+        job['status'] = 'running'
+        self.procs[jid] = proc
+        return True
+
+    def resume(self) -> None:
+        """
+        Replays the journal of a previous run: jobs that ended successfully
+        are not run again, jobs still running are followed until they end,
+        and the other ones are run (again).
+
+        Jobs that were running when the previous scheduler died, and are not
+        running anymore, are considered done if they left a `.done` marker
+        (otherwise their stale `.running` marker is removed).
+        """
+        done = []
+        for jid, event in self.journal.replay().items():
+            if jid not in self.jobs:
+                continue
+            job = self.jobs[jid]
+            if event['event'] == 'end':
+                if event['status'] == 'done':
+                    self.tracker.release(jid)
+                continue
+            if (event['pstart'] is not None and
+                process_start_time(event['pid']) == event['pstart'] and
+                self.adopt(jid, event['pid'], event['time'])):
+                continue
+            if marker_status(job) == 'done':
+                self.tracker.release(jid)
+                done.append(jid)
+            elif job_workdir(job) is not None:
+                try:
+                    os.remove(os.path.join(job_workdir(job), '.running'))
+                except FileNotFoundError:
+                    pass
+        self.journal.open()
+        for jid in done:
+            self.journal.ended(jid, 'done')
+
+    def log_path(self, jid: int):
+        """
+        :returns: path to the file with the output of a job (None if not kept)
+        """
+        if self.log_dir is None:
+            return None
+        name = self.jobs[jid]['name'].replace(os.sep, '_')
+        return os.path.join(self.log_dir, f'{jid}_{name}.log')
+
+    def tail(self, jid: int, nlines: int=3) -> list:
+        """
+        :returns: last lines of the output of a job (read from the end of its
+           log file, empty if not kept)
+        """
+        path = self.log_path(jid)
+        if path is None or nlines <= 0:
+            return []
+        try:
+            return tail(path, n=nlines, max_bytes=4096)
+        except OSError:
+            return []
+
+    def pooled(self, jid: int) -> bool:
+        """
+        :returns: True if a job is run by the pool of Python workers
+        """
+        if not self.python_workers:
+            return False
+        if jid not in self.calls:
+            job  = self.jobs[jid]
+            spec = _python_call(job)
+            self.calls[jid] = None if spec is None else job_workdir(job)
+            if spec is not None:
+                # preloaded by the workers if seen before the pool starts
+                self._modules.add((spec['root'], spec['module']))
+        return self.calls[jid] is not None
+
+    def _pool_full(self, jid: int) -> bool:
+        """
+        :returns: True if a job is run by the pool of Python workers and none
+           of them is free
+        """
+        return self.pooled(jid) and self._pool_busy >= self.python_workers
+
+    def start(self, jid: int):
+        """
+        Starts the command of a job.
+
+        Its output goes to a file (never to a pipe: a job writing more than
+        the pipe buffer would block forever).
+
+        :returns: the process
+        """
+        if self.pooled(jid):
+            return self._submit(jid)
+        job = self.jobs[jid]
+        path = self.log_path(jid)
+        log = DEVNULL if path is None else open(path, 'wb')
+        try:
+            if self.limits is None:
+                proc = Popen(job['cmd'], shell=True, stdout=log, stderr=STDOUT)
+            else:
+                # own session: signals reach all the processes of the job
+                proc = Popen(job['cmd'], shell=True, stdout=log, stderr=STDOUT,
+                             start_new_session=True,
+                             preexec_fn=self.limits.preexec(jid, job['mem']))
+                self.limits.register(jid, proc.pid, job['mem'],
+                                     self.durations[jid], self.started[jid])
+        finally:
+            if path is not None:
+                log.close()
+        if self._use_pidfd:
+            fd = os.pidfd_open(proc.pid)
+            self._selector.register(fd, selectors.EVENT_READ, jid)
+        return proc
+
+    def _submit(self, jid: int):
+        """
+        Runs a process backed by a Python function in the pool of workers
+        (started at first use).
+
+        :returns: the pending call
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.python_workers, mp_context=get_context('forkserver'),
+                initializer=preload, initargs=(sorted(self._modules), ))
+            self._calls_pipe = os.pipe()
+            for fd in self._calls_pipe:
+                os.set_blocking(fd, False)
+            self._selector.register(self._calls_pipe[0], selectors.EVENT_READ,
+                                    self._collect_calls)
+        future = self._pool.submit(run_process, self.calls[jid])
+        future.add_done_callback(self._wake_up)
+        self._pool_busy += 1
+        return _Pooled_call(future)
+
+    def _wake_up(self, future) -> None:
+        # called from a thread of the pool when a call ends
+        try:
+            os.write(self._calls_pipe[1], b'.')
+        except BlockingIOError:  # enough wake-ups pending
+            pass
+
+    def _collect_calls(self) -> None:
+        try:
+            while os.read(self._calls_pipe[0], 4096):
+                pass
+        except BlockingIOError:
+            pass
+        for jid, proc in list(self.procs.items()):
+            if isinstance(proc, _Pooled_call) and proc.future.done():
+                self.finish(jid, proc.wait())
+
+    def finish(self, jid: int, return_code: int) -> None:
+        job = self.jobs[jid]
+        self.available_cpu += job['cpus-per-task']
+        self.available_mem += job['mem']
+        if isinstance(self.procs.pop(jid), _Pooled_call):
+            self._pool_busy -= 1  # whatever noticed the end of the call
+        self.ended[jid] = self.now()
+        killed = self.limits.release(jid) if self.limits is not None else None
+        if killed:
+            self.tracker.fail(jid, killed)
+        elif return_code != 0:
+            self.tracker.fail(jid)
+        else:
+            self.tracker.release(jid)
+        if self.journal is not None:
+            self.journal.ended(jid, job['status'])
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until at least one job finishes or `timeout` seconds elapse.
+
+        Other file objects can be registered in the selector with a function
+        as data, it is called when they are ready (e.g. sockets of
+        `sf.cluster.Worker`).
+
+        :returns: True if some job finished
+        """
+        finished = False
+        if self._use_pidfd:
+            for key, _ in self._selector.select(timeout):
+                if callable(key.data):
+                    key.data()
+                    continue
+                jid = key.data
+                self._selector.unregister(key.fd)
+                os.close(key.fd)
+                self.finish(jid, self.procs[jid].wait())
+                finished = True
+            return finished
+        for key, _ in self._selector.select(timeout):
+            if callable(key.data):
+                key.data()
+                continue
+            try:
+                while os.read(self._sigchld_pipe[0], 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        for jid, proc in list(self.procs.items()):
+            return_code = proc.poll()
+            if return_code is not None:
+                self.finish(jid, return_code)
+                finished = True
+        return finished
+
+    def _watch_sigchld(self) -> None:
+        self._sigchld_pipe = os.pipe()
+        for fd in self._sigchld_pipe:
+            os.set_blocking(fd, False)
+        signal.signal(signal.SIGCHLD, lambda *_: None)
+        signal.set_wakeup_fd(self._sigchld_pipe[1])
+        self._selector.register(self._sigchld_pipe[0], selectors.EVENT_READ)
+
+    def _update(self, force: bool=False) -> None:
+        if self.on_update is None:
+            return
+        now = time()
+        if force or now - self._last_update >= self.refresh:
+            self._last_update = now
+            self.on_update(self)
+
+    def _timeout(self):
+        """
+        Checks the limits of running jobs.
+
+        :returns: maximum time to wait for jobs (None to wait until one ends)
+        """
+        timeout = self.refresh if self.on_update else None
+        wake_ups = []
+        if self.limits is not None:
+            wake_ups.append(self.limits.check(self.now()))
+        if self.journal is not None:
+            wake_ups.append(self.journal.next_sync())
+        if not self._use_pidfd and any(isinstance(p, Adopted)
+                                       for p in self.procs.values()):
+            # no SIGCHLD from jobs of a previous run
+            wake_ups.append(1)
+        for wake_up in wake_ups:
+            if wake_up is not None:
+                timeout = wake_up if timeout is None else min(timeout, wake_up)
+        return timeout
+
+    def run(self) -> None:
+        """
+        Run all jobs, returns when there is nothing left to run.
+        """
+        if not self._use_pidfd:
+            self._watch_sigchld()
+        if self.journal is not None:
+            self.resume()
+        for jid in self.jobs:
+            self.pooled(jid)  # modules of all calls preloaded by the pool
+        self._last_update = 0
+        self.start_time   = self.now()
+        while True:
+            self.dispatch()
+            if not self.procs:
+                # nothing running: remaining ready jobs do not fit in the
+                # resources and will never run
+                for _, jid in self.tracker.ready:
+                    if self.jobs[jid]['status'] == 'pending':
+                        self.ended[jid] = self.now()
+                        self.tracker.fail(jid)
+                self.tracker.ready.clear()
+                break
+            self._update()
+            self.wait(self._timeout())
+        self._update(force=True)
+        self._selector.close()
+        if self.limits is not None:
+            self.limits.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self._pool is not None:
+            self._pool.shutdown()
+            for fd in self._calls_pipe:
+                os.close(fd)
+        if self._sigchld_pipe is not None:
+            signal.set_wakeup_fd(-1)
+            for fd in self._sigchld_pipe:
+                os.close(fd)
+
+
+class _Pooled_call:
+    """
+    Process run by the pool of Python workers, with the `Popen` methods used by
+    the scheduler.
+    """
+    pid = None
+
+    def __init__(self, future):
+        self.future = future
+
+    def poll(self):
+        return self.wait() if self.future.done() else None
+
+    def wait(self) -> int:
+        try:
+            return self.future.result()
+        except Exception:  # e.g. worker killed
+            return 1
+
+
+def _python_call(job: dict):
+    """
+    :returns: the call run by a job if it can be run by a persistent Python
+       worker (a process backed by a Python function, with no container), None
+       otherwise
+    """
+    workdir = job_workdir(job)
+    if workdir is None or job['cmd'].strip() != f'/bin/bash {workdir}/.command.sh':
+        return None
+    spec = load_call(os.path.join(workdir, '.call.pkl'))
+    return spec if spec is not None and spec['in_process'] else None
+
+
+class Simulator(Scheduler):
+    """
+    Scheduler running on a virtual clock: commands are not executed, and each
+    job lasts exactly its declared time. Used to compare scheduling policies.
+
+    After `run`, `clock` holds the makespan (in seconds).
+    """
+    def __init__(self, jobs: dict, total_cpu: int, total_mem: float,
+                 policy: str='greedy'):
+        super().__init__(jobs, total_cpu, total_mem, policy=policy)
+        self._use_pidfd = True  # no SIGCHLD handler needed
+        self.clock      = 0
+        self._ends      = []  # heap of (end time, job ID)
+
+    def now(self) -> float:
+        return self.clock
+
+    def start(self, jid: int):
+        end = self.clock + self.durations[jid]
+        heapq.heappush(self._ends, (end, jid))
+        return end
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Advances the clock to the end of the next job(s).
+        """
+        self.clock = self._ends[0][0]
+        while self._ends and self._ends[0][0] <= self.clock:
+            _, jid = heapq.heappop(self._ends)
+            self.finish(jid, 0)
+        return True
+
+
+def _pidfd_supported() -> bool:
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        return False
+    return True
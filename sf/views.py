@@ -6,6 +6,7 @@ def generate_mermaid_html(graph_data, metadata_dict, output_file="graph.html"):
         'error'          : '#CD4439',
         'done'           : '#72B896',
         'missingoutput'  : '#E29173',
+        'stale'          : '#E2C173',
     }
     for d in metadata_dict.values():
         d['color'] = colors[d['class']]
@@ -309,6 +310,12 @@ def generate_mermaid_html(graph_data, metadata_dict, output_file="graph.html"):
                             <tr>
                                 <td><span class="highlight">Outputs</span></td><td>${{data.outputs || '??'}}</td>
                             </tr>
+                            <tr>
+                                <td><span class="highlight">CPU (peak / average)</span></td><td>${{data.peak_cpu || 'N/A'}} / ${{data.average_cpu || 'N/A'}}</td>
+                            </tr>
+                            <tr>
+                                <td><span class="highlight">Memory (peak / average)</span></td><td>${{data.peak_mem || 'N/A'}} / ${{data.average_mem || 'N/A'}}</td>
+                            </tr>
                         </tbody>
                     </table>
                     `;